@@ -1,44 +1,37 @@
 import os
-import openai
-import requests
 import time
 import json
 import re 
 import sys
 import hashlib
 import signal # NEW: For graceful exit
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.http import MediaFileUpload
-from google.auth.exceptions import RefreshError
-from googleapiclient.errors import HttpError
-from json.decoder import JSONDecodeError
-
-# MoviePy/Pillow Imports and Patches
-from moviepy.editor import VideoFileClip, AudioFileClip, CompositeVideoClip, TextClip, ImageClip, concatenate_videoclips, CompositeAudioClip
-from moviepy.config import change_settings 
-from gtts import gTTS 
+import math
+import threading
+import queue
+import concurrent.futures
+import sqlite3
+import random
+import datetime
+import email.utils
+import collections
+import functools
+import io
+import tempfile
+import wave
+import bisect
+import resource
+import contextvars
+import cProfile
+import argparse
 import shutil 
+import socket
+from contextlib import closing, contextmanager
+from json.decoder import JSONDecodeError
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
 
-# --- CRITICAL FIX: PATCH for MOVIEPY/PILLOW (PIL) ANTIALIAS ERROR ---
-try:
-    from PIL import Image
-    if not hasattr(Image, 'ANTIALIAS'):
-        if hasattr(Image.Resampling, 'LANCZOS'):
-            Image.ANTIALIAS = Image.Resampling.LANCZOS
-            print("Pillow ANTIALIAS constant successfully patched (using Image.Resampling.LANCZOS).")
-        elif hasattr(Image, 'LANCZOS'):
-             Image.ANTIALIAS = Image.LANCZOS
-             print("Pillow ANTIALIAS constant successfully patched (using Image.LANCZOS).")
-        else:
-             print("Warning: Could not find LANCZOS or ANTIALIAS. MoviePy may fail.")
-except ImportError:
-    print("Warning: Pillow is not installed.")
-except Exception as e:
-    print(f"Warning: Could not apply Pillow patch: {e}")
-# ------------------------------------------------------------------
+# MoviePy, the Google API client, OpenAI, requests and gTTS are imported where they are first used
+# (see load_moviepy), so commands that don't need them start quickly.
 
 
 # ######################################################################
@@ -54,225 +47,1368 @@ PEXELS_API_KEY = "XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX" # Your Pexels API
 PEXELS_BASE_URL = "https://api.pexels.com/v1/"
 BACKGROUND_MUSIC_PATH = "background_music.mp3" 
 
+# --- TRENDING TOPICS ---
+TRENDING_REGIONS = ['US', 'GB', 'CA', 'AU', 'IN'] # Charts fetched in one pass; earlier regions are used first
+TRENDING_PAGES_PER_REGION = 2 # Pages of 50 chart entries per region
+TOPIC_CANDIDATE_TTL = 3600 # Seconds before queued candidates are considered stale and the charts are fetched again
+SEEN_TOPICS_DB = "seen_topics.sqlite" # Every topic ever used, so a restarted job doesn't repeat topics
+
+# --- LLM ---
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+CONTENT_MODEL = "openai/gpt-3.5-turbo" # Script, visual queries and the combined video package
+METADATA_MODEL = "deepseek/deepseek-r1-0528-qwen3-8b:free" # Standalone metadata and thumbnail text calls
+USE_COMBINED_LLM_CALL = True # One JSON call for script, visual queries, metadata and thumbnail text. False uses the separate calls.
+LLM_CACHE_FILE = "llm_cache.sqlite" # Responses keyed by model + prompt hash; re-runs skip calls already paid for
+LLM_MAX_CONCURRENCY = 4 # Max chat requests in flight at once across all pipeline threads
+
+# --- STOCK IMAGE FETCHING ---
+PEXELS_FETCH_WORKERS = 5 # Parallel search/download requests per video
+HTTP_TIMEOUT = (5, 30) # (connect, read) seconds for every Pexels request
+IMAGE_CACHE_FOLDER = "image_cache" # Persistent cache shared by all videos and runs
+IMAGE_CACHE_MAX_BYTES = 500 * 1024 * 1024 # Least recently used images are evicted above this size
+
+# --- VOICEOVER ---
+TTS_ENGINE = "gtts" # "gtts" (Google Translate TTS, online) or "offline" (local placeholder tones, for testing without network)
+TTS_LANG = "en"
+TTS_TLD = "com" # gTTS accent, e.g. "co.uk" or "com.au"
+TTS_WORKERS = 4 # Sentences synthesized in parallel
+TTS_CACHE_FOLDER = "tts_cache" # Synthesized sentences, keyed by engine, voice and text
+
 # --- BATCH PROCESSING ---
 VIDEOS_PER_BATCH = 3
 TOTAL_BATCHES = 4
 
+# --- THUMBNAILS ---
+THUMBNAIL_TEMPLATE = "classic" # Template used for uploads
+THUMBNAIL_TEMPLATES = { # background: a colour or an image path (scaled to cover the thumbnail)
+    'classic': {'size': (1280, 720), 'background': 'red', 'font_size': 100, 'fill': 'yellow', 'stroke': 'black', 'stroke_width': 5, 'text_width': 0.9},
+}
+
+# --- RENDERING ---
+SINGLE_PASS_RENDER = True # Encode slideshow, title and audio in one pass. Set False for the old montage + final two-step render.
+VIDEO_SIZE = (1920, 1080)
+VIDEO_FPS = 24
+KEN_BURNS_BACKEND = "numpy" # "numpy" (precomputed sampling windows, one pre-scaled source) or "moviepy" (legacy per-frame PIL resize)
+KEN_BURNS_START_ZOOM = 1.1
+KEN_BURNS_END_ZOOM = 1.0
+IMAGE_PREPROCESS_WORKERS = 2 # Threads decoding/scaling stock images into memory-mappable arrays (numpy backend)
+CAPTION_RENDERER = "pillow" # "pillow" (in-process rasterizer) or "imagemagick" (legacy TextClip, one `convert` process per caption)
+CAPTION_FONT_FILES = [ # First font that loads is used for captions and the title card
+    "Arial Bold.ttf", "arialbd.ttf",
+    "/System/Library/Fonts/Supplemental/Arial Bold.ttf", "/Library/Fonts/Arial Bold.ttf",
+    "/usr/share/fonts/truetype/msttcorefonts/Arial_Bold.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", "DejaVuSans-Bold.ttf",
+]
+
+# --- ENCODING ---
+ENCODING_PROFILE = "upload" # Profile used for final videos this run (see ENCODING_PROFILES)
+ENCODING_PROFILES = { # crf/audio_bitrate/threads of None leave ffmpeg's default
+    'upload': {'container': 'mp4', 'codec': 'libx264', 'preset': 'medium', 'crf': 23, 'threads': None, 'audio_codec': 'aac', 'audio_bitrate': '192k',
+               'ffmpeg_params': ['-profile:v', 'high', '-bf', '2', '-g', str(VIDEO_FPS // 2)]}, # YouTube's recommended H.264 settings: High profile, 2 B-frames, GOP of half the frame rate
+    'fast-draft': {'container': 'mp4', 'codec': 'libx264', 'preset': 'ultrafast', 'crf': 28, 'threads': None, 'audio_codec': 'aac', 'audio_bitrate': '128k'},
+    'mezzanine': {'container': 'mov', 'codec': 'libx264', 'preset': 'medium', 'crf': None, 'threads': None, 'audio_codec': 'pcm_s16le', 'audio_bitrate': None}, # The old output: x264 defaults, uncompressed audio
+}
+
+# --- RATE LIMITS & QUOTA ---
+YOUTUBE_DAILY_QUOTA = 10000 # Data API units per day (resets at midnight Pacific time)
+YOUTUBE_QUOTA_COSTS = {'videos.list': 1, 'videos.insert': 1600, 'thumbnails.set': 50, 'videos.insert.chunk': 0} # Only starting an upload is charged, not its chunks
+YOUTUBE_UNITS_PER_VIDEO = YOUTUBE_QUOTA_COSTS['videos.insert'] + YOUTUBE_QUOTA_COSTS['thumbnails.set'] + YOUTUBE_QUOTA_COSTS['videos.list']
+YOUTUBE_QUOTA_FILE = "youtube_quota.json" # Units used today, kept across restarts
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024 # Bytes per resumable upload request (a multiple of 256 KiB); progress is checkpointed after each one
+RATE_LIMITS = { # service: (requests per second, burst size)
+    'youtube': (5, 10),
+    'openrouter': (20 / 60, 20), # OpenRouter free models: 20 requests/minute
+    'pexels': (200 / 3600, 200), # Pexels: 200 requests/hour
+    'pexels_images': (20, 20), # Photo downloads from Pexels' image CDN don't count against the API limit; only retried
+    'tts': (4, 8), # Google Translate TTS has no published limit but answers 429 when hammered
+}
+MAX_RETRIES = 5 # Retries for rate-limited (429) and transient (5xx, connection) errors
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 300
+
+# --- PIPELINE CONCURRENCY ---
+JOBS_FOLDER = "jobs" # Each video gets its own scratch directory (voiceover, montage, stock images) under here
+PREP_WORKERS = 2 # Threads running topic/script/image/voiceover preparation (network-bound)
+RENDER_WORKERS = max(1, (os.cpu_count() or 2) // 2) # Render processes; each also runs a multi-threaded ffmpeg encoder
+UPLOAD_WORKERS = 1 # Threads running hash check, metadata, upload and thumbnail
+PIPELINE_QUEUE_SIZE = 2 # Max finished jobs waiting between two stages
+JOB_JOURNAL_DB = "job_journal.sqlite" # Every job and the stages it has finished; unfinished jobs resume on the next run
+JOB_STAGES = ('topic', 'content', 'assets', 'voiceover', 'render', 'metadata', 'upload', 'thumbnail')
+JOB_MAX_ATTEMPTS = 3 # A failing job is retried (from its first unfinished stage) this many times per run
+
+# --- JOB QUEUE (multi-worker) ---
+SPOOL_FOLDER = "spool" # discover/render/upload jobs as files; share it (with jobs/) between hosts to spread workers over several machines
+QUEUE_KINDS = ('discover', 'render', 'upload') # Each kind's finished jobs are queued for the next one
+QUEUE_VISIBILITY_TIMEOUT = 600 # Seconds without a heartbeat before a leased job is handed to another worker
+QUEUE_HEARTBEAT_SECONDS = 30 # How often a worker refreshes the leases it holds (keep well below the visibility timeout)
+QUEUE_POLL_SECONDS = 5 # How often an idle worker looks for new jobs
+
+# --- METRICS ---
+METRICS_FOLDER = "metrics" # Timing spans per job (<job id>.jsonl) and the Prometheus summary
+METRICS_PROM_FILE = os.path.join(METRICS_FOLDER, "analyse.prom") # Prometheus textfile format (node_exporter --collector.textfile.directory=metrics)
+PROFILE_RENDER = os.environ.get("ANALYSE_PROFILE_RENDER") == "1" # Opt-in: cProfile every render into METRICS_FOLDER/<job id>.render.prof
+
 # --- UPLOAD & LOGGING ---
-PROCESSED_LOG_FILE = 'uploaded_video_hashes.txt' 
+PROCESSED_LOG_FILE = 'uploaded_video_hashes.txt' # Legacy hash log, imported into DEDUP_DB on startup
+DEDUP_DB = "video_hashes.sqlite" # Indexed store of uploaded video hashes and content fingerprints
+DEDUP_CONTENT_PRECHECK = True # Skip rendering when the topic + script fingerprint was already uploaded
+HASH_WHILE_ENCODING = True # Hash the final video as ffmpeg writes it (through a named pipe) instead of re-reading it afterwards
 HASH_BUF_SIZE = 65536
 SCOPES = ['https://www.googleapis.com/auth/youtube.upload', 'https://www.googleapis.com/auth/youtube.force-ssl'] # Added force-ssl scope for thumbnail upload
 
 # --- MOVIEPY/IMAGEMAGICK FIX (For macOS) ---
-try:
-    IMAGEMAGICK_BINARY = "/opt/homebrew/bin/convert" 
-    change_settings({"IMAGEMAGICK_BINARY": IMAGEMAGICK_BINARY})
-    print(f"Set ImageMagick path to: {IMAGEMAGICK_BINARY}")
-except Exception: 
-    print("Warning: Could not set ImageMagick path. Check ImageMagick installation.")
+IMAGEMAGICK_BINARY = "/opt/homebrew/bin/convert" # Set in MoviePy when it is first loaded
 # --------------------------------------------
 
 USED_TOPICS = set()
-STOCK_IMAGE_FOLDER = "stock_images"
-THUMBNAIL_FOLDER = "thumbnails" # NEW: Thumbnail folder
-if not os.path.exists(STOCK_IMAGE_FOLDER):
-    os.makedirs(STOCK_IMAGE_FOLDER)
-if not os.path.exists(THUMBNAIL_FOLDER): # NEW: Create thumbnail folder
-    os.makedirs(THUMBNAIL_FOLDER)
-
-# Initialize OpenAI Client for Content Generation
-try:
-    openai_client = openai.OpenAI(
-        api_key=OPENROUTER_API_KEY,
-        base_url="https://openrouter.ai/api/v1" 
-    )
-except Exception as e:
-    print(f"Failed to initialize OpenAI client for content generation: {e}")
-    openai_client = None
+STOCK_IMAGE_FOLDER = "stock_images" # Created when images are first downloaded into it
 
 
 # ######################################################################
 # #################### PART 2: VIDEO CREATION FUNCTIONS ##################
 # ######################################################################
 
-def get_trending_topic(api_key, used_topics, region_code='US', max_results=20):
-    """Fetches a unique trending YouTube video title."""
+@functools.lru_cache(maxsize=None)
+def load_moviepy():
+    """Imports and returns moviepy.editor on first use (with IPython and imageio it takes most of a full import),
+    after patching Pillow for it and pointing it at ImageMagick."""
+    # --- CRITICAL FIX: PATCH for MOVIEPY/PILLOW (PIL) ANTIALIAS ERROR ---
+    if not hasattr(Image, 'ANTIALIAS'):
+        if hasattr(Image, 'Resampling') and hasattr(Image.Resampling, 'LANCZOS'): Image.ANTIALIAS = Image.Resampling.LANCZOS
+        elif hasattr(Image, 'LANCZOS'): Image.ANTIALIAS = Image.LANCZOS
+        else: print("Warning: Could not find LANCZOS or ANTIALIAS. MoviePy may fail.")
+    import moviepy.editor
+    from moviepy.config import change_settings
+    try: change_settings({"IMAGEMAGICK_BINARY": IMAGEMAGICK_BINARY})
+    except Exception: print("Warning: Could not set ImageMagick path. Check ImageMagick installation.")
+    return moviepy.editor
+
+def open_database(path):
+    """Opens a SQLite database in autocommit mode, set up for several concurrent readers and writers."""
+    db = sqlite3.connect(path, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    return db
+
+_span_stack = contextvars.ContextVar('span_stack', default=())
+_current_job = contextvars.ContextVar('current_job', default=None)
+
+class Span:
+    """Times a block: wall time, CPU time of the calling thread (and of finished child processes such as ffmpeg),
+    the process's peak RSS, plus bytes and retries added with span_add(). Recorded in METRICS on exit."""
+
+    def __init__(self, name):
+        self.name = name
+        self.counters = {'bytes_in': 0, 'bytes_out': 0, 'retries': 0}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.started_at, self.wall_start, self.cpu_start = time.time(), time.perf_counter(), time.thread_time()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.child_cpu_start = children.ru_utime + children.ru_stime
+        self.token = _span_stack.set(_span_stack.get() + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _span_stack.reset(self.token)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        job = _current_job.get()
+        METRICS.record({'span': self.name, 'job_id': job and job['id'], 'video_num': job and job['video_num'], 'pid': os.getpid(),
+                        'started_at': round(self.started_at, 3), 'wall_seconds': round(time.perf_counter() - self.wall_start, 4),
+                        'cpu_seconds': round(time.thread_time() - self.cpu_start, 4),
+                        'child_cpu_seconds': round(children.ru_utime + children.ru_stime - self.child_cpu_start, 4),
+                        'peak_rss_bytes': peak_rss_bytes(), **self.counters, 'outcome': 'error' if exc_type else 'ok'})
+        return False
+
+def span_add(bytes_in=0, bytes_out=0, retries=0):
+    """Adds bytes transferred or retries to every span open in the current context."""
+    for span in _span_stack.get():
+        with span.lock:
+            span.counters['bytes_in'] += bytes_in; span.counters['bytes_out'] += bytes_out; span.counters['retries'] += retries
+
+def instrumented(fn):
+    """Decorator: records a Span named after the function around every call."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with Span(fn.__name__): return fn(*args, **kwargs)
+    return wrapper
+
+def in_caller_context(fn):
+    """Wraps fn so pool threads run it in (a copy of) the caller's context and their bytes/retries reach its spans."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+@contextmanager
+def job_context(job):
+    """Attributes the spans recorded inside the block to a job."""
+    token = _current_job.set(job)
+    try: yield
+    finally: _current_job.reset(token)
+
+class MetricsRecorder:
+    """Collects spans: each is appended to METRICS_FOLDER/<job id>.jsonl and added to per-span totals,
+    which write_prometheus() exports in the Prometheus textfile format."""
+
+    def __init__(self, folder=METRICS_FOLDER, prom_file=METRICS_PROM_FILE, labels=None):
+        self.folder, self.prom_file = folder, prom_file
+        self.labels = labels or {} # Added to every series, e.g. {'worker': ...} when several processes share METRICS_FOLDER
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.unreported = None # In render workers: spans to hand back to the main process
+
+    def record(self, span):
+        line = json.dumps(span)
+        with self.lock:
+            self._add(span)
+            if self.unreported is not None: self.unreported.append(span)
+            if span['job_id']:
+                os.makedirs(self.folder, exist_ok=True)
+                with open(os.path.join(self.folder, f"{span['job_id']}.jsonl"), 'a') as f: f.write(line + "\n")
+
+    def _add(self, span):
+        totals = self.totals.setdefault(span['span'], collections.Counter())
+        totals[f"calls_{span['outcome']}"] += 1
+        for key in ('wall_seconds', 'cpu_seconds', 'child_cpu_seconds', 'bytes_in', 'bytes_out', 'retries'): totals[key] += span[key]
+        totals['wall_seconds_max'] = max(totals['wall_seconds_max'], span['wall_seconds'])
+        totals['peak_rss_bytes'] = max(totals['peak_rss_bytes'], span['peak_rss_bytes'])
+
+    def drain(self):
+        """Returns (and forgets) the spans recorded since the last drain; used by render workers."""
+        with self.lock:
+            spans, self.unreported = self.unreported or [], []
+        return spans
+
+    def merge(self, spans):
+        """Adds spans recorded in a worker process (which already wrote them to the job's JSONL file) to the totals."""
+        with self.lock:
+            for span in spans: self._add(span)
+
+    def write_prometheus(self):
+        """Writes the per-span totals atomically in the Prometheus textfile format."""
+        metrics = [('analyse_span_calls_total', 'counter', 'Calls per pipeline function and outcome.', None),
+                   ('analyse_span_wall_seconds_total', 'counter', 'Wall time spent in each pipeline function.', 'wall_seconds'),
+                   ('analyse_span_wall_seconds_max', 'gauge', 'Slowest single call of each pipeline function.', 'wall_seconds_max'),
+                   ('analyse_span_cpu_seconds_total', 'counter', 'CPU time of the calling thread in each pipeline function.', 'cpu_seconds'),
+                   ('analyse_span_child_cpu_seconds_total', 'counter', 'CPU time of child processes (ffmpeg) that finished during each function.', 'child_cpu_seconds'),
+                   ('analyse_span_bytes_total', 'counter', 'Bytes transferred by each pipeline function.', None),
+                   ('analyse_span_retries_total', 'counter', 'Retried API calls or upload chunks in each pipeline function.', 'retries'),
+                   ('analyse_span_peak_rss_bytes', 'gauge', 'Highest process peak RSS seen at the end of each pipeline function.', 'peak_rss_bytes')]
+        with self.lock: totals = {name: dict(counter) for name, counter in sorted(self.totals.items())}
+        lines, labels = [], ''.join(f'{name}="{value}",' for name, value in sorted(self.labels.items()))
+        for metric, kind, help_text, key in metrics:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            for name, values in totals.items():
+                if metric == 'analyse_span_calls_total':
+                    lines += [f'{metric}{{{labels}span="{name}",outcome="{outcome}"}} {values.get(f"calls_{outcome}", 0)}' for outcome in ('ok', 'error')]
+                elif metric == 'analyse_span_bytes_total':
+                    lines += [f'{metric}{{{labels}span="{name}",direction="{direction}"}} {values.get(f"bytes_{direction}", 0)}' for direction in ('in', 'out')]
+                else: lines.append(f'{metric}{{{labels}span="{name}"}} {values.get(key, 0):g}')
+        os.makedirs(os.path.dirname(self.prom_file) or ".", exist_ok=True)
+        tmp_path = f"{self.prom_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f: f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_file)
+
+METRICS = MetricsRecorder()
+
+class QuotaExceededError(Exception):
+    """Raised when a YouTube call would go over the daily Data API quota."""
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate, self.capacity = rate, capacity
+        self.tokens, self.updated = capacity, time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` are available and takes them."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens; return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+def _quota_day():
+    """Returns the current YouTube quota day (quota resets at midnight Pacific time)."""
     try:
-        youtube = build('youtube', 'v3', developerKey=api_key)
-        request = youtube.videos().list(part="snippet", chart="mostPopular", regionCode=region_code, maxResults=max_results)
-        response = request.execute()
-        for item in response['items']:
-            title = item['snippet']['title']
-            if title not in used_topics:
-                used_topics.add(title)
-                return title
-        return None
+        from zoneinfo import ZoneInfo
+        return datetime.datetime.now(ZoneInfo("America/Los_Angeles")).date().isoformat()
+    except Exception:
+        return (datetime.datetime.utcnow() - datetime.timedelta(hours=8)).date().isoformat()
+
+def _retry_after_seconds(value):
+    """Parses a Retry-After header (seconds or HTTP date)."""
+    if not value: return None
+    try: return max(0.0, float(value))
+    except ValueError: pass
+    try: return max(0.0, (email.utils.parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except Exception: return None
+
+def loaded_exception_types(module_name, *names):
+    """The named exception classes of a module, or () if it was never imported (then none of its errors can occur)."""
+    module = sys.modules.get(module_name)
+    return tuple(getattr(module, name) for name in names) if module else ()
+
+def classify_error(error):
+    """Returns (retryable, retry_after_seconds) for an exception raised by a YouTube, OpenRouter, Pexels or TTS call."""
+    if isinstance(error, QuotaExceededError): return False, None
+    if isinstance(error, loaded_exception_types('googleapiclient.errors', 'HttpError')):
+        status, headers = error.resp.status, error.resp
+        if status == 403: # rateLimitExceeded is transient, quotaExceeded lasts until the daily reset
+            reason = getattr(error, 'error_details', None) or error.content.decode(errors='ignore')
+            return 'rateLimitExceeded' in str(reason) or 'userRateLimitExceeded' in str(reason), _retry_after_seconds(headers.get('retry-after'))
+    elif isinstance(error, loaded_exception_types('requests', 'ConnectionError', 'Timeout') + loaded_exception_types('openai', 'APIConnectionError') + (ConnectionError, TimeoutError)):
+        return True, None
+    else:
+        response = getattr(error, 'response', None)
+        if response is None: response = getattr(error, 'rsp', None) # gTTSError keeps the HTTP response in .rsp
+        status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+        headers = getattr(response, 'headers', None) or {}
+        if status is None: # e.g. a gTTSError raised from a connection error
+            return classify_error(error.__cause__) if error.__cause__ is not None else (False, None)
+    return status == 429 or status >= 500, _retry_after_seconds(headers.get('retry-after') or headers.get('Retry-After'))
+
+class RateScheduler:
+    """Central pacing for every external API call.
+
+    Each service has a token bucket; YouTube calls are also charged against the daily Data API
+    quota (persisted in YOUTUBE_QUOTA_FILE, which every process sharing it updates under a file
+    lock, so a cron `upload` and a `run` add up their usage). Rate-limited and transient failures are retried with
+    jittered exponential backoff that honours Retry-After."""
+
+    def __init__(self, limits=RATE_LIMITS, daily_quota=YOUTUBE_DAILY_QUOTA, quota_file=YOUTUBE_QUOTA_FILE):
+        self.buckets = {service: TokenBucket(rate, burst) for service, (rate, burst) in limits.items()}
+        self.daily_quota, self.quota_file = daily_quota, quota_file
+        self.quota_lock = threading.Lock()
+        self.retries = {service: 0 for service in limits}
+
+    def _load_quota(self):
+        """Reads today's usage from the file every time: other processes may have charged it since."""
+        try:
+            with open(self.quota_file) as f: quota = json.load(f)
+        except (OSError, ValueError): quota = {}
+        return quota if quota.get('day') == _quota_day() else {'day': _quota_day(), 'used': 0}
+
+    @contextmanager
+    def _quota_file_lock(self):
+        """Holds an exclusive lock on the quota file across processes (a no-op without flock, i.e. on Windows)."""
+        try: import fcntl
+        except ImportError: fcntl = None
+        with open(f"{self.quota_file}.lock", 'a') as lock_file:
+            if fcntl: fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield # Closing the file releases the lock
+
+    def _charge_quota(self, operation):
+        cost = YOUTUBE_QUOTA_COSTS.get(operation, 1)
+        with self.quota_lock, self._quota_file_lock():
+            quota = self._load_quota()
+            if quota['used'] + cost > self.daily_quota:
+                raise QuotaExceededError(f"{operation} needs {cost} units but only {self.daily_quota - quota['used']} of today's YouTube quota are left")
+            quota['used'] += cost
+            tmp_path = f"{self.quota_file}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f: json.dump(quota, f)
+            os.replace(tmp_path, self.quota_file)
+
+    def quota_remaining(self):
+        with self.quota_lock: return self.daily_quota - self._load_quota()['used']
+
+    def quota_report(self):
+        with self.quota_lock: used = self._load_quota()['used']
+        return f"YouTube quota used today: {used}/{self.daily_quota} units ({used / self.daily_quota * 100:.1f}%)"
+
+    def wait_for_youtube_quota(self, units):
+        """Sleeps until the daily quota has at least `units` left (i.e. until the next reset if needed)."""
+        while self.quota_remaining() < units:
+            print(f"--- {self.quota_report()}. Waiting for the daily reset... ---")
+            if SHUTDOWN.wait(600): return
+
+    @staticmethod
+    def backoff_delay(attempt):
+        """Jittered exponential backoff for the given (0-based) attempt."""
+        return random.uniform(0.5, 1.0) * min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+
+    def call(self, service, fn, *args, operation=None, max_retries=MAX_RETRIES, **kwargs):
+        """Runs fn(*args, **kwargs) once the service's rate limit (and, for YouTube, quota) allows it, retrying retryable errors."""
+        for attempt in range(max_retries + 1):
+            self.buckets[service].acquire()
+            if service == 'youtube': self._charge_quota(operation)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                retryable, retry_after = classify_error(e)
+                if not retryable or attempt == max_retries: raise
+                delay = max(retry_after or 0, self.backoff_delay(attempt))
+                self.retries[service] += 1
+                span_add(retries=1)
+                print(f"  -> {service} {operation or 'call'} failed ({e.__class__.__name__}); retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+SCHEDULER = RateScheduler()
+
+class LLMClient:
+    """Chat completions with a persistent response cache and a cap on concurrent requests.
+
+    Responses are cached in SQLite under a hash of the model, messages and parameters, so a
+    re-run (e.g. after a crash) gets the same answer without paying for the call again. Without a
+    `client`, an OpenRouter client is created on the first cache miss."""
+
+    def __init__(self, client=None, cache_path=LLM_CACHE_FILE, max_concurrency=LLM_MAX_CONCURRENCY):
+        self._client, self.cache_path = client, cache_path
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.cache_ready = False
+        self.client_lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @property
+    def client(self):
+        with self.client_lock:
+            if self._client is None:
+                import openai
+                self._client = openai.OpenAI(api_key=OPENROUTER_API_KEY, base_url=OPENROUTER_BASE_URL, max_retries=0) # SCHEDULER does the retrying
+            return self._client
+
+    def _db(self):
+        db = open_database(self.cache_path)
+        if not self.cache_ready:
+            db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL)")
+            self.cache_ready = True
+        return db
+
+    @staticmethod
+    def cache_key(model, messages, params):
+        return hashlib.sha256(json.dumps({'model': model, 'messages': messages, 'params': params}, sort_keys=True).encode()).hexdigest()
+
+    def chat(self, model, messages, validate=None, use_cache=True, **params):
+        """Returns the reply text. Only replies accepted by `validate` (if given) are cached."""
+        key = self.cache_key(model, messages, params)
+        if use_cache:
+            with closing(self._db()) as db:
+                row = db.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.hits += 1
+                print(f"  -> LLM cache hit ({model})")
+                return row[0]
+        with self.slots:
+            response = SCHEDULER.call('openrouter', self.client.chat.completions.create, model=model, messages=messages, **params)
+        self.misses += 1
+        content = response.choices[0].message.content or ""
+        span_add(bytes_in=len(content.encode()), bytes_out=len(json.dumps(messages).encode()))
+        if use_cache and (validate is None or validate(content)):
+            with closing(self._db()) as db:
+                db.execute("INSERT OR REPLACE INTO responses (key, model, content, created_at) VALUES (?, ?, ?, ?)", (key, model, content, time.time()))
+        return content
+
+llm = LLMClient()
+
+class TopicProvider:
+    """Hands out unique trending topics from a local candidate queue.
+
+    The YouTube client is built once; charts for all TRENDING_REGIONS are fetched (and paginated)
+    in one pass whenever the queue is empty or older than the TTL. Used topics are recorded in an
+    indexed SQLite table, so dedup is a primary-key lookup and survives restarts."""
+
+    def __init__(self, api_key=YOUTUBE_API_KEY, regions=TRENDING_REGIONS, pages_per_region=TRENDING_PAGES_PER_REGION,
+                 ttl=TOPIC_CANDIDATE_TTL, db_path=SEEN_TOPICS_DB, youtube=None):
+        self.api_key, self.regions, self.pages_per_region, self.ttl = api_key, regions, pages_per_region, ttl
+        self.db_path = db_path
+        self.youtube = youtube
+        self.candidates = collections.deque()
+        self.fetched_at = 0.0
+        self.lock = threading.Lock()
+        with closing(open_database(db_path)) as db:
+            db.execute("CREATE TABLE IF NOT EXISTS seen_topics (topic_key TEXT PRIMARY KEY, title TEXT NOT NULL, seen_at REAL NOT NULL)")
+
+    @staticmethod
+    def topic_key(title):
+        return " ".join(title.casefold().split())
+
+    def _client(self):
+        if self.youtube is None:
+            from googleapiclient.discovery import build
+            self.youtube = build('youtube', 'v3', developerKey=self.api_key, cache_discovery=False)
+        return self.youtube
+
+    def is_seen(self, title):
+        with closing(open_database(self.db_path)) as db:
+            return db.execute("SELECT 1 FROM seen_topics WHERE topic_key = ?", (self.topic_key(title),)).fetchone() is not None
+
+    def _claim(self, title):
+        """Marks a topic as used; False if it already was (also when another process claimed it first)."""
+        with closing(open_database(self.db_path)) as db:
+            return db.execute("INSERT OR IGNORE INTO seen_topics (topic_key, title, seen_at) VALUES (?, ?, ?)", (self.topic_key(title), title, time.time())).rowcount == 1
+
+    def _fetch_charts(self):
+        """Fetches the mostPopular chart of every region and returns the titles not seen before, in chart order."""
+        youtube = self._client()
+        titles, keys = [], set()
+        for region in self.regions:
+            page_token = None
+            for _ in range(self.pages_per_region):
+                request = youtube.videos().list(part="snippet", chart="mostPopular", regionCode=region, maxResults=50,
+                                                pageToken=page_token, fields="nextPageToken,items/snippet/title")
+                try: response = SCHEDULER.call('youtube', request.execute, operation='videos.list')
+                except Exception as e:
+                    print(f"An error occurred while fetching YouTube data ({region}): {e}"); break
+                for item in response.get('items', []):
+                    title = item['snippet']['title']
+                    if self.topic_key(title) not in keys:
+                        keys.add(self.topic_key(title)); titles.append(title)
+                page_token = response.get('nextPageToken')
+                if not page_token: break
+        with closing(open_database(self.db_path)) as db:
+            seen = {row[0] for row in db.execute(f"SELECT topic_key FROM seen_topics WHERE topic_key IN ({','.join('?' * len(keys))})", list(keys))} if keys else set()
+        return [title for title in titles if self.topic_key(title) not in seen]
+
+    def next_topic(self):
+        """Returns a trending title that has never been used, or None if the charts have nothing new."""
+        with self.lock:
+            if not self.candidates or time.time() - self.fetched_at > self.ttl:
+                self.candidates = collections.deque(self._fetch_charts())
+                self.fetched_at = time.time()
+                print(f"  -> Queued {len(self.candidates)} new trending topic candidates from {len(self.regions)} regions.")
+            while self.candidates:
+                title = self.candidates.popleft()
+                if self._claim(title): return title
+            return None
+
+_topic_providers = {}
+_topic_providers_lock = threading.Lock()
+
+@instrumented
+def get_trending_topic(api_key, used_topics=None):
+    """Returns a unique trending YouTube video title (never used before, even across restarts)."""
+    with _topic_providers_lock:
+        if api_key not in _topic_providers: _topic_providers[api_key] = TopicProvider(api_key)
+        provider = _topic_providers[api_key]
+    try:
+        title = provider.next_topic()
     except Exception as e:
         print(f"An error occurred while fetching YouTube data: {e}")
         return None
+    if title and used_topics is not None: used_topics.add(title)
+    return title
 
+@instrumented
 def generate_script(topic):
     """Generates a video script."""
-    if not openai_client: return None
     try:
         prompt_content = (f"Write a 45-second script for a friendly, engaging YouTube video about the trending topic: '{topic}'. "
             f"The script must include a strong call to action at the end. Only return the script text, nothing else.")
-        response = openai_client.chat.completions.create(model="openai/gpt-3.5-turbo", messages=[
+        content = llm.chat(CONTENT_MODEL, [
                 {"role": "system", "content": "You are a creative scriptwriter."},
-                {"role": "user", "content": prompt_content}], max_tokens=250, temperature=0.8)
-        return response.choices[0].message.content.strip()
+                {"role": "user", "content": prompt_content}], validate=str.strip, max_tokens=250, temperature=0.8)
+        return content.strip()
     except Exception as e:
         print(f"An error occurred while generating script: {e}")
         return None
 
+@instrumented
 def generate_visual_prompts(script, required_prompts=5): 
     """Generates visual search queries."""
-    if not openai_client: return []
     try:
         prompt_content = f"Based on the following script, generate a list of {required_prompts} concise, specific, visual search queries. Return ONLY the list, with each query on a new line.\n\nSCRIPT:\n---\n{script}"
-        response = openai_client.chat.completions.create(model="openai/gpt-3.5-turbo", messages=[
+        content = llm.chat(CONTENT_MODEL, [
                 {"role": "system", "content": "You are a creative visual prompt generator."},
-                {"role": "user", "content": prompt_content}], max_tokens=required_prompts * 30, temperature=0.3)
-        return [p.strip() for p in response.choices[0].message.content.strip().split('\n') if p.strip()]
+                {"role": "user", "content": prompt_content}], validate=str.strip, max_tokens=required_prompts * 30, temperature=0.3)
+        return [p.strip() for p in content.strip().split('\n') if p.strip()]
     except Exception: return []
 
-def download_stock_images(prompts):
-    """Searches Pexels and saves images locally."""
+@instrumented
+def generate_video_package(topic):
+    """Gets script, visual queries, title/description/tags and thumbnail text from ONE structured JSON call.
+
+    Returns a dict with keys script, visual_queries (list), metadata (title/description/tags) and thumbnail_text, or None."""
+    prompt_content = (f"Create a complete YouTube video package about the trending topic: '{topic}'. "
+        "Return a SINGLE, VALID, RAW JSON OBJECT with exactly these keys:\n"
+        "'script': a friendly, engaging 45-second script with a strong call to action at the end, written as plain sentences ending in periods;\n"
+        "'visual_queries': a list with one concise, specific visual search query for each sentence of the script;\n"
+        "'title': a catchy video title;\n"
+        "'description': a creative video description;\n"
+        "'tags': 10-15 keywords as one comma-separated string;\n"
+        "'thumbnail_text': the single most attention-grabbing, short (1-5 word) phrase to put on a thumbnail.")
+    def is_complete(content):
+        data = safe_json_load_and_clean(content)
+        return bool(data and data.get('script') and data.get('title'))
+    try:
+        content = llm.chat(CONTENT_MODEL, [
+                {"role": "system", "content": "You are a creative scriptwriter and YouTube SEO assistant. You only answer with JSON."},
+                {"role": "user", "content": prompt_content}], validate=is_complete, max_tokens=900, temperature=0.7, response_format={"type": "json_object"})
+    except Exception as e:
+        print(f"An error occurred while generating the video package: {e}")
+        return None
+    data = safe_json_load_and_clean(content)
+    if not data or not data.get('script') or not data.get('title'):
+        print("Video package was incomplete; falling back to separate LLM calls.")
+        return None
+    queries = data.get('visual_queries') or []
+    if isinstance(queries, str): queries = queries.split('\n')
+    tags = data.get('tags') or ''
+    if isinstance(tags, list): tags = ','.join(str(t) for t in tags)
+    return {'script': data['script'].strip(),
+            'visual_queries': [str(q).strip() for q in queries if str(q).strip()],
+            'metadata': {'title': data['title'], 'description': data.get('description', ''), 'tags': tags},
+            'thumbnail_text': str(data.get('thumbnail_text') or '').strip().upper()}
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """Returns the shared keep-alive HTTP session, with a connection pool sized for the fetch workers."""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            _http_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=PEXELS_FETCH_WORKERS * 2)
+            _http_session.mount("https://", adapter); _http_session.mount("http://", adapter)
+        return _http_session
+
+class ImageCache:
+    """Persistent, content-addressed stock image cache with LRU eviction.
+
+    Two indexes live in a small SQLite file: search query -> photo URL, and photo URL -> file
+    (named by the SHA-256 of its bytes). Files are evicted least-recently-used first once the
+    cache grows past max_bytes."""
+
+    def __init__(self, folder=IMAGE_CACHE_FOLDER, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.folder, self.max_bytes = folder, max_bytes
+        os.makedirs(folder, exist_ok=True)
+        self.db_path = os.path.join(folder, "index.sqlite")
+        with closing(open_database(self.db_path)) as db:
+            db.execute("CREATE TABLE IF NOT EXISTS queries (query TEXT PRIMARY KEY, photo_url TEXT NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS images (photo_url TEXT PRIMARY KEY, digest TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS images_by_access ON images (last_access)")
+
+    @staticmethod
+    def _query_key(query):
+        return " ".join(query.lower().split())
+
+    def _path(self, digest):
+        return os.path.join(self.folder, f"{digest}.jpg")
+
+    def get_photo_url(self, query):
+        with closing(open_database(self.db_path)) as db:
+            row = db.execute("SELECT photo_url FROM queries WHERE query = ?", (self._query_key(query),)).fetchone()
+        return row[0] if row else None
+
+    def put_photo_url(self, query, photo_url):
+        with closing(open_database(self.db_path)) as db:
+            db.execute("INSERT OR REPLACE INTO queries (query, photo_url) VALUES (?, ?)", (self._query_key(query), photo_url))
+
+    def forget_query(self, query):
+        with closing(open_database(self.db_path)) as db:
+            db.execute("DELETE FROM queries WHERE query = ?", (self._query_key(query),))
+
+    def get_image(self, photo_url):
+        """Returns the cached file for a photo URL (and marks it recently used), or None."""
+        with closing(open_database(self.db_path)) as db:
+            row = db.execute("SELECT digest FROM images WHERE photo_url = ?", (photo_url,)).fetchone()
+            if not row: return None
+            if not os.path.exists(self._path(row[0])):
+                db.execute("DELETE FROM images WHERE photo_url = ?", (photo_url,)); return None
+            db.execute("UPDATE images SET last_access = ? WHERE photo_url = ?", (time.time(), photo_url))
+        return self._path(row[0])
+
+    def put_image(self, photo_url, data):
+        """Stores image bytes under their content hash and returns the cached file path."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f: f.write(data)
+            os.replace(tmp_path, path)
+        with closing(open_database(self.db_path)) as db:
+            db.execute("INSERT OR REPLACE INTO images (photo_url, digest, size, last_access) VALUES (?, ?, ?, ?)", (photo_url, digest, len(data), time.time()))
+        self._evict()
+        return path
+
+    def _evict(self):
+        """Deletes least recently used images until the cache fits in max_bytes."""
+        with closing(open_database(self.db_path)) as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+            if total <= self.max_bytes: return
+            for photo_url, digest, size in db.execute("SELECT photo_url, digest, size FROM images ORDER BY last_access").fetchall():
+                if total <= self.max_bytes: break
+                db.execute("DELETE FROM images WHERE photo_url = ?", (photo_url,))
+                if not db.execute("SELECT 1 FROM images WHERE digest = ?", (digest,)).fetchone():
+                    try: os.remove(self._path(digest))
+                    except OSError: pass
+                total -= size
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+def get_image_cache():
+    """Returns the shared image cache, creating it on first use."""
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None: _image_cache = ImageCache()
+        return _image_cache
+
+def fetch_stock_image(query, cache, session=None):
+    """Finds and downloads one Pexels image for a query through the cache.
+
+    Returns (cached_file_path or None, stats) where stats counts cache hits/misses and bytes fetched."""
+    session = session or get_http_session()
+    headers = {"Authorization": PEXELS_API_KEY}
+    stats = {'hits': 0, 'misses': 0, 'bytes': 0}
+    photo_url = cache.get_photo_url(query)
+    if photo_url: stats['hits'] += 1
+    else:
+        stats['misses'] += 1
+        def search():
+            response = session.get(PEXELS_BASE_URL + "search", headers=headers, params={"query": query, "per_page": 1, "orientation": "landscape"}, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+            return response
+        response = SCHEDULER.call('pexels', search)
+        stats['bytes'] += len(response.content)
+        data = response.json()
+        if not data.get('photos'): return None, stats
+        photo_url = data['photos'][0]['src']['large']
+        cache.put_photo_url(query, photo_url)
+    cached_path = cache.get_image(photo_url)
+    if cached_path:
+        stats['hits'] += 1
+        return cached_path, stats
+    stats['misses'] += 1
+    def download():
+        response = session.get(photo_url, timeout=HTTP_TIMEOUT)
+        if response.status_code == 404: cache.forget_query(query) # Photo was removed; search again next time
+        response.raise_for_status()
+        return response
+    image_response = SCHEDULER.call('pexels_images', download, operation='download')
+    stats['bytes'] += len(image_response.content)
+    return cache.put_image(photo_url, image_response.content), stats
+
+@instrumented
+def download_stock_images(prompts, image_folder=STOCK_IMAGE_FOLDER):
+    """Searches Pexels and saves images locally, fetching in parallel through the persistent image cache."""
     if not PEXELS_API_KEY: 
         print("\n!!! WARNING: Pexels API Key is not set. Skipping automated image download.")
         return False
-    try: shutil.rmtree(STOCK_IMAGE_FOLDER); os.makedirs(STOCK_IMAGE_FOLDER)
+    try: shutil.rmtree(image_folder)
     except Exception: pass
-    headers = {"Authorization": PEXELS_API_KEY}
+    os.makedirs(image_folder, exist_ok=True)
+    cache = get_image_cache()
+    totals = {'hits': 0, 'misses': 0, 'bytes': 0}
     success_count = 0
-    for i, query in enumerate(prompts):
-        try:
-            response = requests.get(PEXELS_BASE_URL + "search", headers=headers, params={"query": query, "per_page": 1, "orientation": "landscape"})
-            data = response.json()
-            if data['photos']:
-                photo_url = data['photos'][0]['src']['large']
-                image_response = requests.get(photo_url, stream=True)
-                filename = f"image_{i+1}_{query.replace(' ', '_')[:20]}.jpg"
-                file_path = os.path.join(STOCK_IMAGE_FOLDER, filename)
-                with open(file_path, 'wb') as f:
-                    for chunk in image_response.iter_content(chunk_size=8192): f.write(chunk)
-                success_count += 1
-        except Exception: pass
+    with concurrent.futures.ThreadPoolExecutor(max_workers=PEXELS_FETCH_WORKERS) as executor:
+        futures = [executor.submit(in_caller_context(fetch_stock_image), query, cache) for query in prompts]
+        for i, (query, future) in enumerate(zip(prompts, futures)):
+            try: cached_path, stats = future.result()
+            except Exception as e:
+                print(f"  -> Image fetch failed for '{query}': {e}"); continue
+            for key in totals: totals[key] += stats[key]
+            if not cached_path: continue
+            file_path = os.path.join(image_folder, f"image_{i+1}_{query.replace(' ', '_')[:20]}.jpg")
+            try: os.link(cached_path, file_path) # Hard link survives cache eviction without copying
+            except OSError: shutil.copyfile(cached_path, file_path)
+            success_count += 1
+    span_add(bytes_in=totals['bytes'])
+    print(f"  -> Stock images: {success_count}/{len(prompts)} ready | cache hits {totals['hits']}, misses {totals['misses']} | {totals['bytes'] / 1024:.0f} KB fetched")
     return success_count > 0
 
-def create_text_and_voiceover(script):
-    """Generates a voiceover audio file."""
-    tts = gTTS(text=script, lang='en')
-    audio_path = "voiceover.mp3"
-    tts.save(audio_path)
+class GTTSEngine:
+    """Google Translate text-to-speech (online, MP3)."""
+    name, extension = 'gtts', 'mp3'
+
+    def __init__(self, lang=TTS_LANG, tld=TTS_TLD):
+        self.lang, self.tld = lang, tld
+        self.voice = f"{lang}@{tld}"
+
+    def synthesize(self, text, path):
+        from gtts import gTTS
+        gTTS(text=text, lang=self.lang, tld=self.tld).save(path)
+
+class OfflineTTSEngine:
+    """Local stand-in for testing: a quiet tone per word at a speaking pace, so timings look like real speech. No network."""
+    name, extension = 'offline', 'wav'
+
+    def __init__(self, words_per_minute=160, sample_rate=22050):
+        self.words_per_minute, self.sample_rate = words_per_minute, sample_rate
+        self.voice = f"tone@{words_per_minute}wpm"
+
+    def synthesize(self, text, path):
+        beat = int(self.sample_rate * 60 / self.words_per_minute)
+        t = np.arange(int(beat * 0.75)) / self.sample_rate
+        samples = []
+        for word in text.split():
+            tone = 0.2 * np.sin(2 * np.pi * (140 + 15 * (len(word) % 5)) * t) * np.hanning(len(t))
+            samples += [tone, np.zeros(beat - len(t))]
+        samples.append(np.zeros(self.sample_rate // 4)) # Pause at the end of the sentence
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1); f.setsampwidth(2); f.setframerate(self.sample_rate)
+            f.writeframes((np.concatenate(samples) * 32767).astype(np.int16).tobytes())
+
+TTS_ENGINES = {'gtts': GTTSEngine, 'offline': OfflineTTSEngine}
+
+def get_tts_engine(name=None):
+    return TTS_ENGINES[name or TTS_ENGINE]()
+
+def synthesize_sentences(sentences, engine=None, cache_folder=TTS_CACHE_FOLDER, workers=TTS_WORKERS):
+    """Synthesizes each sentence in parallel and returns their audio files in order.
+
+    Files are cached by engine, voice and text, so re-runs with the same sentences skip synthesis."""
+    engine = engine or get_tts_engine()
+    os.makedirs(cache_folder, exist_ok=True)
+
+    def synthesize(text):
+        key = hashlib.sha256(json.dumps([engine.name, engine.voice, text]).encode()).hexdigest()
+        path = os.path.join(cache_folder, f"{key}.{engine.extension}")
+        if os.path.exists(path): return path
+        tmp_path = os.path.join(cache_folder, f"{key}.{threading.get_ident()}.tmp.{engine.extension}")
+        SCHEDULER.call('tts', engine.synthesize, text, tmp_path, operation='synthesize')
+        span_add(bytes_in=os.path.getsize(tmp_path))
+        os.replace(tmp_path, path)
+        return path
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(in_caller_context(synthesize), sentences))
+
+def voiceover_segments_path(audio_path):
+    return f"{audio_path}.segments.json"
+
+def load_segment_durations(audio_path):
+    """Returns the spoken length of each sentence in a voiceover made by create_text_and_voiceover, or None."""
+    try:
+        with open(voiceover_segments_path(audio_path)) as f: return json.load(f)
+    except (OSError, ValueError): return None
+
+@instrumented
+def create_text_and_voiceover(script_lines, audio_path="voiceover.mp3", engine=None):
+    """Generates a voiceover audio file from per-sentence speech.
+
+    The length of each sentence is saved next to it (<voiceover>.segments.json) so captions and images follow the speech."""
+    start = time.perf_counter()
+    sentence_files = synthesize_sentences([f"{line}." for line in script_lines], engine)
+    mpy = load_moviepy()
+    sentence_clips = [mpy.AudioFileClip(path) for path in sentence_files]
+    voiceover = mpy.concatenate_audioclips(sentence_clips)
+    with _fork_lock: voiceover.write_audiofile(audio_path, logger=None) # A render process forked meanwhile would keep ffmpeg's stdin open
+    with open(voiceover_segments_path(audio_path), 'w') as f: json.dump([clip.duration for clip in sentence_clips], f)
+    for clip in sentence_clips: clip.close()
+    print(f"  -> Voiceover: {len(sentence_files)} sentences, {voiceover.duration:.1f}s of speech, synthesized in {time.perf_counter() - start:.1f}s")
     return audio_path
 
-def create_visual_video(voiceover_path, script_lines):
+@functools.lru_cache(maxsize=32)
+def load_font(size, font_files=tuple(CAPTION_FONT_FILES)):
+    """Loads (once per size) the first available caption font."""
+    for font_file in font_files:
+        try: return ImageFont.truetype(font_file, size)
+        except OSError: continue
+    print("Warning: No caption font found in CAPTION_FONT_FILES. Using Pillow's default font.")
+    try: return ImageFont.load_default(size)
+    except TypeError: return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=8192)
+def measure_text(text, size, font_files=tuple(CAPTION_FONT_FILES)):
+    """Returns the rendered width of a word or line in pixels (cached, captions reuse the same words a lot)."""
+    return load_font(size, font_files).getlength(text)
+
+def wrap_text(text, size, max_width, font_files=tuple(CAPTION_FONT_FILES)):
+    """Greedy word wrap to max_width pixels in the first available font of font_files. A single word wider than the box gets its own line."""
+    lines, current = [], ""
+    for word in text.split():
+        candidate = f"{current} {word}" if current else word
+        if current and measure_text(candidate, size, font_files) > max_width:
+            lines.append(current); current = word
+        else: current = candidate
+    if current: lines.append(current)
+    return lines or [""]
+
+def render_text_image(text, fontsize, color, bg_color=None, width=None, stroke_color=None, stroke_width=0):
+    """Rasterizes text in-process and returns an RGBA uint8 array.
+
+    With `width`, text is wrapped and centred in a box of that width (like ImageMagick's `caption:`);
+    without it, the image is just big enough for one line (like `label:`). `bg_color` fills the box."""
+    font = load_font(fontsize)
+    stroke = int(round(stroke_width)) if stroke_color else 0
+    lines = wrap_text(text, fontsize, int(width) - 2 * stroke) if width else [text]
+    ascent, descent = font.getmetrics()
+    line_height = ascent + descent + 2 * stroke
+    box_width = int(width) if width else int(math.ceil(max(measure_text(line, fontsize) for line in lines))) + 2 * stroke
+    image = Image.new('RGBA', (max(1, box_width), line_height * len(lines)), bg_color or (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        x = (box_width - measure_text(line, fontsize)) / 2
+        draw.text((x, i * line_height + stroke), line, font=font, fill=color, stroke_width=stroke, stroke_fill=stroke_color)
+    return np.asarray(image)
+
+def make_text_clip(text, fontsize, color, bg_color=None, width=None, stroke_color=None, stroke_width=0):
+    """Returns a text clip from the configured caption renderer (RGBA array -> clip with alpha mask for Pillow)."""
+    if CAPTION_RENDERER == "imagemagick":
+        options = {'bg_color': bg_color or 'transparent'}
+        if width: options.update(size=(width, None), method='caption')
+        if stroke_color: options.update(stroke_color=stroke_color, stroke_width=stroke_width)
+        return load_moviepy().TextClip(text, fontsize=fontsize, color=color, font="Arial-Bold", **options)
+    return load_moviepy().ImageClip(render_text_image(text, fontsize, color, bg_color, width, stroke_color, stroke_width))
+
+def preprocessed_image_path(image_path, size=VIDEO_SIZE, start_zoom=KEN_BURNS_START_ZOOM, end_zoom=KEN_BURNS_END_ZOOM):
+    return f"{image_path}.{size[0]}x{size[1]}_{start_zoom:g}-{end_zoom:g}.npy"
+
+def preprocess_image(image_path, size=VIDEO_SIZE, start_zoom=KEN_BURNS_START_ZOOM, end_zoom=KEN_BURNS_END_ZOOM):
+    """Decodes an image once, crops it to the centre part the zoom can ever show and scales that by start_zoom.
+
+    The result (at most 1.1x the frame size with the default zoom) is saved as a raw .npy array next to the
+    image so renders can memory-map it instead of holding the full-resolution image. Returns the .npy path."""
+    path = preprocessed_image_path(image_path, size, start_zoom, end_zoom)
+    if os.path.exists(path): return path
+    min_zoom = min(start_zoom, end_zoom)
+    with Image.open(image_path) as img:
+        # Same parity as the image so the crop keeps the exact centre; +2 keeps a margin for bilinear sampling
+        crop_w = min(img.width, math.ceil(size[0] / min_zoom) + 2 + (img.width - math.ceil(size[0] / min_zoom)) % 2)
+        crop_h = min(img.height, math.ceil(size[1] / min_zoom) + 2 + (img.height - math.ceil(size[1] / min_zoom)) % 2)
+        left, top = (img.width - crop_w) // 2, (img.height - crop_h) // 2
+        img = img.crop((left, top, left + crop_w, top + crop_h)).convert('RGB')
+        # Scale once to the largest zoom so every frame only samples (slightly) downwards from this source.
+        source = np.asarray(img.resize((max(1, round(crop_w * start_zoom)), max(1, round(crop_h * start_zoom))), Image.LANCZOS))
+    tmp_path = f"{path}.{threading.get_ident()}.tmp.npy"
+    np.save(tmp_path, source)
+    os.replace(tmp_path, path)
+    return path
+
+@instrumented
+def preprocess_images(image_folder, workers=IMAGE_PREPROCESS_WORKERS):
+    """Preprocesses every image in a folder for the Ken Burns engine (see preprocess_image)."""
+    image_files = [os.path.join(image_folder, f) for f in sorted(os.listdir(image_folder)) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(preprocess_image, image_files))
+
+def peak_rss_bytes(reset=False):
+    """Peak resident memory of this process. With reset=True a new peak starts (Linux; elsewhere it's the peak since start)."""
+    if reset:
+        try:
+            with open('/proc/self/clear_refs', 'w') as f: f.write('5')
+        except OSError: pass
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'): return int(line.split()[1]) * 1024
+    except OSError: pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # Bytes on macOS, KiB elsewhere
+
+class KenBurnsSegment:
+    """Ken Burns frames for one image, sampled from a single pre-scaled source with batched NumPy indexing.
+
+    Matches the legacy `ImageClip(...).resize(lambda t: 1.1 - 0.1 * t / d).set_position('center')` look:
+    the image is zoomed out from START to END zoom around its centre on a black frame. The source is the
+    memory-mapped output of preprocess_image, opened on first use and closed again by release()."""
+
+    def __init__(self, image_path, duration, size=VIDEO_SIZE, fps=VIDEO_FPS, start_zoom=KEN_BURNS_START_ZOOM, end_zoom=KEN_BURNS_END_ZOOM):
+        self.duration, self.size, self.fps = duration, size, fps
+        self.source_path = preprocess_image(image_path, size, start_zoom, end_zoom)
+        self._source = None
+        self.frames_rendered = 0
+        self.render_seconds = 0.0
+        self._precompute_windows(start_zoom, end_zoom)
+        self.release()
+
+    @property
+    def source(self):
+        if self._source is None: self._source = np.load(self.source_path, mmap_mode='r')
+        return self._source
+
+    def release(self):
+        """Unmaps the source; it's mapped again if another frame is needed."""
+        self._source = None
+
+    def _precompute_windows(self, start_zoom, end_zoom):
+        """Computes the source sampling window (indices and weights) for every output frame at once."""
+        width, height = self.size
+        src_h, src_w = self.source.shape[:2]
+        self.num_frames = max(1, int(math.ceil(self.duration * self.fps)))
+        t = np.arange(self.num_frames) / self.fps
+        scale = (start_zoom + (end_zoom - start_zoom) * t / self.duration) / start_zoom  # relative to the pre-scaled source
+        self.cols = self._axis_windows(width, src_w, scale)
+        self.rows = self._axis_windows(height, src_h, scale)
+
+    @staticmethod
+    def _axis_windows(out_len, src_len, scale):
+        """Maps output pixel centres to source coordinates for each frame: (lo, hi, i0, i1, weight) per frame."""
+        coords = (np.arange(out_len) + 0.5 - out_len / 2)[None, :] / scale[:, None] + src_len / 2 - 0.5
+        visible = (coords >= -0.5) & (coords <= src_len - 0.5)
+        any_visible = visible.any(axis=1)
+        lo = np.where(any_visible, visible.argmax(axis=1), 0)
+        hi = np.where(any_visible, out_len - visible[:, ::-1].argmax(axis=1), 0)
+        coords = np.clip(coords, 0, src_len - 1)
+        i0 = np.floor(coords).astype(np.int32)
+        i1 = np.minimum(i0 + 1, src_len - 1)
+        weight = np.round((coords - i0) * 256).astype(np.uint16)  # 8-bit fixed-point interpolation weight
+        return lo, hi, i0, i1, weight
+
+    def make_frame(self, t):
+        """Returns the RGB frame at time t (bilinear sample of the visible window, black elsewhere)."""
+        start = time.perf_counter()
+        n = min(max(int(t * self.fps + 1e-6), 0), self.num_frames - 1)
+        width, height = self.size
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        (y_lo, y_hi, y0, y1, wy), (x_lo, x_hi, x0, x1, wx) = ([a[n] for a in self.rows], [a[n] for a in self.cols])
+        if y_hi > y_lo and x_hi > x_lo:
+            y0, y1, wy = y0[y_lo:y_hi], y1[y_lo:y_hi], wy[y_lo:y_hi, None, None]
+            x0, x1, wx = x0[x_lo:x_hi], x1[x_lo:x_hi], wx[None, x_lo:x_hi, None]
+            rows = self.source[y0].astype(np.uint16) * (256 - wy)
+            rows += self.source[y1] * wy
+            rows >>= 8
+            block = rows[:, x0] * (256 - wx)
+            block += rows[:, x1] * wx
+            block >>= 8
+            frame[y_lo:y_hi, x_lo:x_hi] = block
+        self.frames_rendered += 1
+        self.render_seconds += time.perf_counter() - start
+        return frame
+
+class Slideshow:
+    """Lazy slideshow compositor: each frame is computed from the current segment only.
+
+    Draws the segment's Ken Burns frame (black without an image), blends its caption at the bottom and
+    fades in from black at the start of every segment but the first. That is the look of the old
+    per-segment CompositeVideoClip + crossfadein + concatenate_videoclips(method="compose"), without
+    MoviePy holding a composite per segment. Only the current segment's source and caption are in memory."""
+
+    def __init__(self, segments, durations, captions, size=VIDEO_SIZE, fade_duration=0.3, caption_opacity=0.85):
+        self.segments, self.durations, self.captions = segments, durations, captions
+        self.starts = np.cumsum([0] + list(durations[:-1])).tolist()
+        self.frame_size, self.fade_duration, self.caption_opacity = size, fade_duration, caption_opacity
+        self.current, self.caption = None, None
+
+    def to_clip(self):
+        """A MoviePy clip drawing its frames from this slideshow."""
+        return load_moviepy().VideoClip(self.make_frame, duration=sum(self.durations))
+
+    def _activate(self, i):
+        """Releases the previous segment and rasterizes the caption of segment i."""
+        if self.current is not None and self.segments[self.current] is not None: self.segments[self.current].release()
+        self.current = i
+        text_clip = make_text_clip(self.captions[i], fontsize=45, color='white', bg_color="black", width=self.frame_size[0]*0.9,
+                                   stroke_color='black', stroke_width=2.5)
+        rgb = text_clip.get_frame(0)[:, :, :3].astype(np.uint16)
+        alpha = text_clip.mask.get_frame(0) if text_clip.mask is not None else np.ones(rgb.shape[:2])
+        weight = np.round(alpha * self.caption_opacity * 256).astype(np.uint16)[:, :, None]
+        height, width = min(rgb.shape[0], self.frame_size[1]), min(rgb.shape[1], self.frame_size[0])
+        x, y = (self.frame_size[0] - width) // 2, self.frame_size[1] - height
+        self.caption = (x, y, rgb[:height, :width] * weight, 256 - weight[:height, :width])
+
+    def make_frame(self, t):
+        i = min(max(bisect.bisect_right(self.starts, t) - 1, 0), len(self.segments) - 1)
+        if i != self.current: self._activate(i)
+        local_t = t - self.starts[i]
+        segment = self.segments[i]
+        frame = segment.make_frame(local_t) if segment is not None else np.zeros((self.frame_size[1], self.frame_size[0], 3), dtype=np.uint8)
+        x, y, weighted_rgb, inverse_weight = self.caption
+        region = frame[y:y + weighted_rgb.shape[0], x:x + weighted_rgb.shape[1]]
+        region[:] = (region * inverse_weight + weighted_rgb) >> 8
+        if i > 0 and local_t < self.fade_duration:
+            frame = ((frame.astype(np.uint16) * int(256 * local_t / self.fade_duration)) >> 8).astype(np.uint8)
+        return frame
+
+def log_ken_burns_stats(visual_clip):
+    """Prints the per-segment frame generation rate of the NumPy Ken Burns engine."""
+    for i, segment in enumerate(getattr(visual_clip, 'ken_burns_segments', [])):
+        if segment is None or not segment.render_seconds: continue
+        print(f"  -> Segment {i+1}: {segment.frames_rendered} Ken Burns frames at {segment.frames_rendered / segment.render_seconds:.0f} fps")
+
+def build_visual_clip(voiceover_path, script_lines, image_folder=STOCK_IMAGE_FOLDER):
+    """Builds the slideshow clip (Ken Burns effect, captions, crossfades) without rendering it."""
+    mpy = load_moviepy()
+    audio_clip = mpy.AudioFileClip(voiceover_path)
+    # FIX APPLIED HERE: Used attribute .duration instead of function .duration()
+    video_duration = audio_clip.duration 
+    script_segments = [line.strip() for line in script_lines if line.strip()]
+    num_segments = len(script_segments)
+    if video_duration == 0 or num_segments == 0: 
+         print("ERROR: Voiceover duration or script length is zero. Cannot create video.")
+         return None
+    segment_durations = load_segment_durations(voiceover_path)
+    if not segment_durations or len(segment_durations) != num_segments: # Older voiceovers: split evenly
+        segment_durations = [video_duration / num_segments] * num_segments
+    segment_durations[-1] = max(segment_durations[-1], video_duration - sum(segment_durations[:-1])) # The last segment runs to the end of the audio
+    transitioned_clips = []
+    image_files = sorted([f for f in os.listdir(image_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]) if os.path.isdir(image_folder) else []
+    if not image_files: image_files = [None] * num_segments
+    elif len(image_files) < num_segments: image_files = (image_files * (num_segments // len(image_files) + 1))[:num_segments]
+
+    if KEN_BURNS_BACKEND == "numpy": # Frames are composed lazily from memory-mapped, preprocessed images
+        ken_burns_segments = [KenBurnsSegment(os.path.join(image_folder, image_file), segment_duration, VIDEO_SIZE) if image_file else None
+                              for image_file, segment_duration in zip(image_files, segment_durations)]
+        final_visual_clip = Slideshow(ken_burns_segments, segment_durations, script_segments, VIDEO_SIZE).to_clip().set_duration(video_duration)
+        final_visual_clip.ken_burns_segments = ken_burns_segments
+        return final_visual_clip
+
+    for i, (text, image_file, segment_duration) in enumerate(zip(script_segments, image_files, segment_durations)):
+        clip_size = VIDEO_SIZE
+        if image_file:
+            img_path = os.path.join(image_folder, image_file)
+            visual_clip = mpy.ImageClip(img_path).set_duration(segment_duration)
+            visual_clip = visual_clip.resize(lambda t, d=segment_duration: KEN_BURNS_START_ZOOM + (KEN_BURNS_END_ZOOM - KEN_BURNS_START_ZOOM) * t / d).set_position('center')
+        else:
+            visual_clip = mpy.ImageClip(color=(0,0,0), size=clip_size).set_duration(segment_duration)
+        
+        text_clip = make_text_clip(text, fontsize=45, color='white', bg_color="black", width=clip_size[0]*0.9,
+                                   stroke_color='black', stroke_width=2.5).set_opacity(0.85).set_pos(("center", "bottom")).set_duration(segment_duration)
+        segment_clip = mpy.CompositeVideoClip([visual_clip, text_clip], size=clip_size)
+        
+        if i > 0: segment_clip = segment_clip.crossfadein(0.3)
+        transitioned_clips.append(segment_clip)
+        
+    return mpy.concatenate_videoclips(transitioned_clips, method="compose").set_duration(video_duration)
+
+class HashingOutput:
+    """A named pipe for ffmpeg to write into; a reader thread copies it to the real file and hashes it on the way.
+
+    The file is therefore never read back from disk just to hash it. The pipe isn't seekable, so the
+    MP4/MOV muxer has to write a fragmented file (see write_video_file). The copy gets its final name
+    only once close() confirms it is complete, so a failed encode never leaves a truncated video behind."""
+
+    def __init__(self, output_path, hash_algorithm='sha256'):
+        self.output_path = output_path
+        self.temp_dir = tempfile.mkdtemp(prefix="hashpipe_", dir=os.path.dirname(os.path.abspath(output_path)))
+        self.fifo_path = os.path.join(self.temp_dir, os.path.basename(output_path)) # Same name: MoviePy derives its temp audio name from it
+        self.partial_path = f"{self.fifo_path}.partial"
+        os.mkfifo(self.fifo_path)
+        self.hasher = hashlib.new(hash_algorithm)
+        self.bytes_written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def _drain(self):
+        try:
+            with open(self.fifo_path, 'rb') as pipe, open(self.partial_path, 'wb') as output:
+                while True:
+                    chunk = pipe.read(HASH_BUF_SIZE * 16)
+                    if not chunk: break
+                    self.hasher.update(chunk)
+                    output.write(chunk)
+                    self.bytes_written += len(chunk)
+        except Exception as e: self.error = e
+
+    def close(self, complete=True):
+        """Waits for the writer to finish, moves the video to output_path and returns its hex digest.
+
+        Returns None (and keeps nothing) if the encoder failed (complete=False) or nothing valid was written."""
+        while self.thread.is_alive():
+            try: os.close(os.open(self.fifo_path, os.O_WRONLY | os.O_NONBLOCK)) # Unblocks the reader if ffmpeg never opened the pipe
+            except OSError: pass # Reader hasn't opened the pipe yet
+            self.thread.join(timeout=0.05)
+        digest = self.hasher.hexdigest() if complete and self.error is None and self.bytes_written else None
+        if digest: os.replace(self.partial_path, self.output_path)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        return digest
+
+def hash_sidecar_path(video_path):
+    return f"{video_path}.sha256"
+
+def write_video_file(clip, output_filename, **write_options):
+    """Writes a clip with MoviePy and returns the output's SHA-256.
+
+    With HASH_WHILE_ENCODING the hash is computed while ffmpeg writes and saved next to the video
+    (<video>.sha256); otherwise None is returned and the hash is computed on demand later."""
+    if not (HASH_WHILE_ENCODING and hasattr(os, 'mkfifo')):
+        temp_dir = tempfile.mkdtemp(prefix="encode_", dir=os.path.dirname(os.path.abspath(output_filename)))
+        try:
+            temp_path = os.path.join(temp_dir, os.path.basename(output_filename)) # Renamed once complete, so a failed encode leaves no truncated video
+            clip.write_videofile(temp_path, **write_options)
+            os.replace(temp_path, output_filename)
+        finally: shutil.rmtree(temp_dir, ignore_errors=True)
+        return None
+    output = HashingOutput(output_filename)
+    ffmpeg_params = list(write_options.pop('ffmpeg_params', None) or []) + ['-movflags', 'frag_keyframe+empty_moov']
+    complete = False
+    try:
+        clip.write_videofile(output.fifo_path, ffmpeg_params=ffmpeg_params, **write_options)
+        complete = True
+    finally:
+        digest = output.close(complete)
+    if digest:
+        with open(hash_sidecar_path(output_filename), 'w') as f: f.write(digest)
+    return digest
+
+def encoding_options(profile=None):
+    """Returns the write_videofile options for an encoding profile (ENCODING_PROFILE by default)."""
+    settings = ENCODING_PROFILES[profile or ENCODING_PROFILE]
+    options = {'codec': settings['codec'], 'preset': settings['preset'], 'audio_codec': settings['audio_codec'], 'fps': VIDEO_FPS,
+               'ffmpeg_params': list(settings.get('ffmpeg_params', []))}
+    if settings.get('crf') is not None: options['ffmpeg_params'] += ['-crf', str(settings['crf'])]
+    if settings.get('audio_bitrate'): options['audio_bitrate'] = settings['audio_bitrate']
+    if settings.get('threads'): options['threads'] = settings['threads']
+    return options
+
+def create_visual_video(voiceover_path, script_lines, image_folder=STOCK_IMAGE_FOLDER, output_filename="visual_montage.mp4"):
     """Creates a slideshow video with Ken Burns effect and crossfades."""
     try:
-        audio_clip = AudioFileClip(voiceover_path)
-        # FIX APPLIED HERE: Used attribute .duration instead of function .duration()
-        video_duration = audio_clip.duration 
-        script_segments = [line.strip() for line in script_lines if line.strip()]
-        num_segments = len(script_segments)
-        if video_duration == 0 or num_segments == 0: 
-             print("ERROR: Voiceover duration or script length is zero. Cannot create video.")
-             return None
-        segment_duration = video_duration / num_segments
-        transitioned_clips = []
-        image_files = sorted([f for f in os.listdir(STOCK_IMAGE_FOLDER) if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
-        if not image_files: image_files = [None] * num_segments
-        elif len(image_files) < num_segments: image_files = (image_files * (num_segments // len(image_files) + 1))[:num_segments]
-
-        for i, (text, image_file) in enumerate(zip(script_segments, image_files)):
-            clip_size = (1920, 1080)
-            if image_file:
-                img_path = os.path.join(STOCK_IMAGE_FOLDER, image_file)
-                visual_clip = ImageClip(img_path).set_duration(segment_duration)
-                visual_clip = visual_clip.resize(lambda t: 1.1 - 0.1 * t / segment_duration).set_position('center')
-            else:
-                visual_clip = ImageClip(color=(0,0,0), size=clip_size).set_duration(segment_duration)
-            
-            text_clip = TextClip(text, fontsize=45, color='white', font="Arial-Bold", bg_color="black", size=(clip_size[0]*0.9, None), 
-                                 method='caption', stroke_color='black', stroke_width=2.5).set_opacity(0.85).set_pos(("center", "bottom")).set_duration(segment_duration)
-            segment_clip = CompositeVideoClip([visual_clip, text_clip], size=clip_size)
-            
-            if i > 0: segment_clip = segment_clip.crossfadein(0.3)
-            transitioned_clips.append(segment_clip)
-            
-        final_visual_clip = concatenate_videoclips(transitioned_clips, method="compose").set_duration(video_duration)
-        output_filename = "visual_montage.mp4"
-        final_visual_clip.write_videofile(output_filename, codec="libx264", fps=24, logger=None) 
+        final_visual_clip = build_visual_clip(voiceover_path, script_lines, image_folder)
+        if final_visual_clip is None: return None
+        final_visual_clip.write_videofile(output_filename, codec="libx264", fps=VIDEO_FPS, logger=None) 
+        log_ken_burns_stats(final_visual_clip)
         return output_filename
     except Exception as e:
         print(f"An error occurred during video creation: {e}")
         return None
 
-def compile_final_video(visual_video_path, voiceover_path, title_text, video_num):
-    """Combines montage, audio, and title overlay."""
+def get_final_video_filename(title_text, video_num, profile=None, output_dir=""):
+    """Builds the output path for a final video in output_dir (the extension follows the encoding profile's container)."""
     safe_title = "".join(c for c in title_text if c.isalnum() or c in (' ', '_')).rstrip()
-    output_filename = f"final_video_{video_num}_{safe_title[:20].replace(' ', '_')}.mov" 
-    
-    try:
-        main_clip = VideoFileClip(visual_video_path)
-        voiceover_clip = AudioFileClip(voiceover_path)
-        title_clip = TextClip(f"🤯 TRENDING: {title_text[:50]}...", fontsize=70, color='yellow', font="Arial-Bold", bg_color="black")
-        title_clip = title_clip.set_pos(("center", "top")).set_duration(3).set_opacity(0.8)
-        final_video = CompositeVideoClip([main_clip, title_clip])
+    return os.path.join(output_dir, f"final_video_{video_num}_{safe_title[:20].replace(' ', '_')}.{ENCODING_PROFILES[profile or ENCODING_PROFILE]['container']}")
 
-        audio_clips_to_merge = [voiceover_clip]
-        if os.path.exists(BACKGROUND_MUSIC_PATH):
-            music_clip = AudioFileClip(BACKGROUND_MUSIC_PATH).volumex(0.3).loop(duration=main_clip.duration).set_duration(main_clip.duration)
-            audio_clips_to_merge.append(music_clip)
+def build_final_clip(main_clip, voiceover_path, title_text):
+    """Adds the title overlay and the voiceover/music mix on top of the slideshow clip."""
+    mpy = load_moviepy()
+    voiceover_clip = mpy.AudioFileClip(voiceover_path)
+    title_clip = make_text_clip(f"🤯 TRENDING: {title_text[:50]}...", fontsize=70, color='yellow', bg_color="black")
+    title_clip = title_clip.set_pos(("center", "top")).set_duration(3).set_opacity(0.8)
+    final_video = mpy.CompositeVideoClip([main_clip, title_clip])
 
-        final_audio = CompositeAudioClip(audio_clips_to_merge)
-        final_video = final_video.set_audio(final_audio)
+    audio_clips_to_merge = [voiceover_clip]
+    if os.path.exists(BACKGROUND_MUSIC_PATH):
+        music_clip = mpy.AudioFileClip(BACKGROUND_MUSIC_PATH).volumex(0.3).loop(duration=main_clip.duration).set_duration(main_clip.duration)
+        audio_clips_to_merge.append(music_clip)
 
-        final_video.write_videofile(output_filename, codec="libx264", audio_codec="pcm_s16le", fps=24 )
+    final_audio = mpy.CompositeAudioClip(audio_clips_to_merge)
+    return final_video.set_audio(final_audio)
+
+def compile_final_video(visual_video_path, voiceover_path, title_text, video_num, profile=None, output_dir=""):
+    """Combines montage, audio, and title overlay."""
+    output_filename = get_final_video_filename(title_text, video_num, profile, output_dir)
+    
+    try:
+        main_clip = load_moviepy().VideoFileClip(visual_video_path)
+        final_video = build_final_clip(main_clip, voiceover_path, title_text)
+        write_video_file(final_video, output_filename, **encoding_options(profile))
         return output_filename
     
     except Exception as e:
         print(f"An error occurred during final video compilation: {e}")
         return None
 
+def compile_video_single_pass(voiceover_path, script_lines, title_text, video_num, image_folder=STOCK_IMAGE_FOLDER, profile=None, output_dir=""):
+    """Builds slideshow, captions, title card, voiceover and music as one composition and encodes it once."""
+    output_filename = get_final_video_filename(title_text, video_num, profile, output_dir)
+    try:
+        visual_clip = build_visual_clip(voiceover_path, script_lines, image_folder)
+        if visual_clip is None: return None
+        final_video = build_final_clip(visual_clip, voiceover_path, title_text)
+        write_video_file(final_video, output_filename, **encoding_options(profile))
+        log_ken_burns_stats(visual_clip)
+        return output_filename
+    except Exception as e:
+        print(f"An error occurred during single-pass video compilation: {e}")
+        return None
+
+@instrumented
+def render_video(voiceover_path, script_lines, title_text, video_num, single_pass=None, image_folder=STOCK_IMAGE_FOLDER, work_dir=".", profile=None):
+    """Renders the final video (into work_dir) in one or two passes with an encoding profile and reports how long it took.
+
+    Returns (final_video_path, intermediate_files)."""
+    if single_pass is None: single_pass = SINGLE_PASS_RENDER
+    profile = profile or ENCODING_PROFILE
+    start = time.perf_counter()
+    peak_rss_bytes(reset=True)
+    if single_pass:
+        final_video_path = compile_video_single_pass(voiceover_path, script_lines, title_text, video_num, image_folder, profile, work_dir)
+        intermediate_files = []
+    else:
+        visual_video_path = create_visual_video(voiceover_path, script_lines, image_folder, os.path.join(work_dir, "visual_montage.mp4"))
+        final_video_path = compile_final_video(visual_video_path, voiceover_path, title_text, video_num, profile, work_dir) if visual_video_path else None
+        intermediate_files = [visual_video_path] if visual_video_path else []
+    elapsed = time.perf_counter() - start
+    size = ""
+    if final_video_path and os.path.exists(final_video_path):
+        span_add(bytes_out=os.path.getsize(final_video_path))
+        size = f", {os.path.getsize(final_video_path) / 1e6:.1f} MB"
+    print(f"  -> Render ({'single-pass' if single_pass else 'two-pass'}, '{profile}' profile) took {elapsed:.1f}s{size}, peak memory {peak_rss_bytes() / 1e6:.0f} MB")
+    return final_video_path, intermediate_files
+
+def compare_render_modes(voiceover_path, script_lines, title_text, image_folder, work_dir="."):
+    """Renders the same video in both modes (into work_dir) and prints a timing comparison. Output files are removed."""
+    timings = {}
+    for single_pass in (False, True):
+        start = time.perf_counter()
+        final_video_path, intermediate_files = render_video(voiceover_path, script_lines, title_text, 0, single_pass=single_pass, image_folder=image_folder, work_dir=work_dir)
+        timings['single-pass' if single_pass else 'two-pass'] = time.perf_counter() - start
+        cleanup_intermediate_files(intermediate_files + ([final_video_path, hash_sidecar_path(final_video_path)] if final_video_path else []))
+    two_pass, single = timings['two-pass'], timings['single-pass']
+    print(f"Render timing: two-pass {two_pass:.1f}s | single-pass {single:.1f}s | saved {two_pass - single:.1f}s ({(1 - single / two_pass) * 100 if two_pass else 0:.0f}%)")
+    return timings
+
 # ######################################################################
 # #################### PART 3: UPLOAD & LOGIC FUNCTIONS ##################
 # ######################################################################
 
-def generate_and_set_thumbnail(client, youtube_service, video_id, video_title):
-    """Generates a text-based thumbnail using ImageMagick and uploads it."""
-    thumbnail_path = os.path.join(THUMBNAIL_FOLDER, f"thumb_{video_id}.jpg")
-    
+def get_thumbnail_text(client, video_title):
+    """Asks the LLM for punchy thumbnail text."""
+    prompt = f"For a YouTube video titled '{video_title}', generate the single most attention-grabbing, short (1-5 word) phrase to put on a thumbnail. Return ONLY the phrase."
+    content = client.chat(METADATA_MODEL, [
+                  {"role": "system", "content": "You are a clickbait title generator."},
+                  {"role": "user", "content": prompt}], validate=str.strip, max_tokens=15, temperature=0.7)
+    return content.strip().upper()
+
+@functools.lru_cache(maxsize=None)
+def load_thumbnail_template(name):
+    """Loads a thumbnail template once: background image, font and text layout."""
+    template = dict(THUMBNAIL_TEMPLATES[name])
+    size = template['size']
+    background = template['background']
+    if os.path.exists(str(background)):
+        with Image.open(background) as img:
+            img = img.convert('RGB')
+            scale = max(size[0] / img.width, size[1] / img.height)
+            img = img.resize((math.ceil(img.width * scale), math.ceil(img.height * scale)), Image.LANCZOS)
+            left, top = (img.width - size[0]) // 2, (img.height - size[1]) // 2
+            template['background'] = img.crop((left, top, left + size[0], top + size[1]))
+    else:
+        template['background'] = Image.new('RGB', size, background)
+    template['font'] = load_font(template['font_size'], tuple(template.get('font_files', CAPTION_FONT_FILES)))
+    return template
+
+def render_thumbnail(text, template=THUMBNAIL_TEMPLATE):
+    """Renders thumbnail text onto a template and returns the JPEG in a BytesIO buffer (nothing touches the disk)."""
+    layout = load_thumbnail_template(template)
+    image = layout['background'].copy()
+    draw = ImageDraw.Draw(image)
+    font, stroke = layout['font'], layout['stroke_width']
+    width, height = layout['size']
+    lines = wrap_text(text, layout['font_size'], width * layout['text_width'] - 2 * stroke, tuple(layout.get('font_files', CAPTION_FONT_FILES))) if text else [""]
+    ascent, descent = font.getmetrics()
+    line_height = ascent + descent
+    y = (height - line_height * len(lines)) / 2
+    for line in lines:
+        draw.text(((width - font.getlength(line)) / 2, y), line, font=font, fill=layout['fill'], stroke_width=stroke, stroke_fill=layout['stroke'])
+        y += line_height
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    buffer.seek(0)
+    return buffer
+
+def render_thumbnails(texts, template=THUMBNAIL_TEMPLATE):
+    """Renders a batch of thumbnails in one call (JPEG encoding releases the GIL, so they run on a small thread pool)."""
+    load_thumbnail_template(template)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(4, max(1, len(texts)))) as executor:
+        return list(executor.map(lambda text: render_thumbnail(text, template), texts))
+
+@instrumented
+def generate_and_set_thumbnail(client, youtube_service, video_id, video_title, thumbnail_text=None):
+    """Generates a text-based thumbnail in memory and uploads it.
+
+    `client` is an LLMClient; it is only called when no thumbnail_text is passed in."""
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaIoBaseUpload
     try:
         # 1. LLM: Get punchy text for the thumbnail
-        prompt = f"For a YouTube video titled '{video_title}', generate the single most attention-grabbing, short (1-5 word) phrase to put on a thumbnail. Return ONLY the phrase."
-        response = client.chat.completions.create(model="deepseek/deepseek-r1-0528-qwen3-8b:free", messages=[
-                      {"role": "system", "content": "You are a clickbait title generator."},
-                      {"role": "user", "content": prompt}], max_tokens=15, temperature=0.7)
-        thumbnail_text = response.choices[0].message.content.strip().upper()
-        print(f"  -> Generated Thumbnail Text: '{thumbnail_text}'")
-        
-        # 2. ImageMagick: Create the image (Requires ImageMagick `convert` binary)
-        if not os.path.exists(IMAGEMAGICK_BINARY):
-            print("  -> WARNING: ImageMagick not found. Skipping thumbnail creation.")
-            return False
-
-        # ImageMagick Command: Create a 1280x720 red background, add yellow text
-        magick_command = (
-            f'{IMAGEMAGICK_BINARY} -size 1280x720 xc:red '
-            f'-font Arial-Bold -pointsize 100 -fill yellow -stroke black -strokewidth 5 '
-            f'-gravity center -annotate 0 "{thumbnail_text}" '
-            f'{thumbnail_path}'
-        )
-        os.system(magick_command)
+        if not thumbnail_text: thumbnail_text = get_thumbnail_text(client, video_title)
+        print(f"  -> Thumbnail Text: '{thumbnail_text}'")
         
-        if not os.path.exists(thumbnail_path):
-             print("  -> ERROR: ImageMagick failed to create the thumbnail file.")
-             return False
+        # 2. Pillow: Render the template into a memory buffer
+        thumbnail = render_thumbnail(thumbnail_text)
+        span_add(bytes_out=thumbnail.getbuffer().nbytes)
 
         # 3. YouTube API: Upload the thumbnail
-        media = MediaFileUpload(thumbnail_path, mimetype='image/jpeg')
-        youtube_service.thumbnails().set(videoId=video_id, media_body=media).execute()
+        media = MediaIoBaseUpload(thumbnail, mimetype='image/jpeg')
+        SCHEDULER.call('youtube', youtube_service.thumbnails().set(videoId=video_id, media_body=media).execute, operation='thumbnails.set')
         print("  -> Thumbnail uploaded successfully.")
         return True
         
@@ -282,19 +1418,65 @@ def generate_and_set_thumbnail(client, youtube_service, video_id, video_title):
     except Exception as e:
         print(f"  -> ERROR during thumbnail creation/upload: {e}")
         return False
-    finally:
-        # Cleanup the local thumbnail file
-        if os.path.exists(thumbnail_path):
-            os.remove(thumbnail_path)
             
+class DedupStore:
+    """Indexed store of uploaded video hashes and content fingerprints (SQLite, safe for concurrent writers).
+
+    Supports `digest in store` (a primary-key lookup) and `store.add(digest)`. Lines appended to the
+    legacy PROCESSED_LOG_FILE are imported once."""
+
+    def __init__(self, db_path=DEDUP_DB, legacy_log=PROCESSED_LOG_FILE):
+        self.db_path = db_path
+        with closing(open_database(db_path)) as db:
+            db.execute("CREATE TABLE IF NOT EXISTS hashes (digest TEXT PRIMARY KEY, kind TEXT NOT NULL, created_at REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if legacy_log and os.path.exists(legacy_log): self._import_legacy_log(legacy_log)
+
+    def _import_legacy_log(self, path):
+        """Imports the lines of the old text log that haven't been imported yet (tracked by byte offset)."""
+        with closing(open_database(self.db_path)) as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT value FROM meta WHERE key = 'legacy_log_offset'").fetchone()
+            offset = int(row[0]) if row else 0
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                lines = f.read().decode(errors='ignore').splitlines()
+                offset = f.tell()
+            db.executemany("INSERT OR IGNORE INTO hashes (digest, kind, created_at) VALUES (?, 'file', ?)", [(line.strip(), time.time()) for line in lines if line.strip()])
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_log_offset', ?)", (str(offset),))
+            db.execute("COMMIT")
+
+    def __contains__(self, digest):
+        if not digest: return False
+        with closing(open_database(self.db_path)) as db:
+            return db.execute("SELECT 1 FROM hashes WHERE digest = ?", (digest,)).fetchone() is not None
+
+    def add(self, digest, kind='file'):
+        """Records a hash ('file' for video bytes, 'content' for topic + script fingerprints)."""
+        if not digest: return
+        with closing(open_database(self.db_path)) as db:
+            db.execute("INSERT OR IGNORE INTO hashes (digest, kind, created_at) VALUES (?, ?, ?)", (digest, kind, time.time()))
+
 def get_processed_videos_hashes():
-    """Reads the log file and returns a set of processed video SHA-256 hashes."""
-    if not os.path.exists(PROCESSED_LOG_FILE): open(PROCESSED_LOG_FILE, 'a').close(); return set()
-    with open(PROCESSED_LOG_FILE, 'r') as f: return {line.strip() for line in f}
+    """Returns the store of processed video SHA-256 hashes."""
+    return DedupStore()
 
-def log_processed_video_hash(video_hash):
-    """Appends a video hash to the log file."""
-    with open(PROCESSED_LOG_FILE, 'a') as f: f.write(f"{video_hash.strip()}\n")
+def content_fingerprint(topic, script):
+    """SHA-256 of the normalized topic and script. Re-encodes of the same content almost never give identical
+    bytes, so this catches duplicates the file hash misses, before anything is rendered."""
+    normalized = " ".join(topic.casefold().split()) + "\n" + " ".join(script.casefold().split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+@instrumented
+def get_video_hash(video_path):
+    """Returns the video's SHA-256 from the hash saved while encoding, or by reading the file if there is none."""
+    sidecar = hash_sidecar_path(video_path)
+    try:
+        if os.path.getmtime(sidecar) >= os.path.getmtime(video_path):
+            with open(sidecar) as f: return f.read().strip()
+    except OSError: pass
+    span_add(bytes_in=os.path.getsize(video_path))
+    return calculate_file_hash(video_path, 'sha256')
 
 def calculate_file_hash(filepath, hash_algorithm='sha256'):
     """Calculates the cryptographic hash (checksum) of a file."""
@@ -311,6 +1493,11 @@ def calculate_file_hash(filepath, hash_algorithm='sha256'):
 
 def get_authenticated_services():
     """Handles Google API authentication for YouTube upload."""
+    from googleapiclient.discovery import build
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google.auth.exceptions import RefreshError
     creds = None
     if os.path.exists('token.json'): creds = Credentials.from_authorized_user_file('token.json', SCOPES)
     if not creds or not creds.valid:
@@ -334,37 +1521,109 @@ def safe_json_load_and_clean(json_string):
         print(f"FATAL JSON PARSING ERROR: Could not parse cleaned JSON string. Error: {e}")
         return None
 
+@instrumented
 def get_video_metadata(client, video_name):
-    """Generates metadata for a SINGLE video using OpenRouter LLM."""
+    """Generates metadata for a SINGLE video using OpenRouter LLM (`client` is an LLMClient)."""
     prompt = f"""You are a helpful assistant for creating YouTube video metadata. For the video name: '{video_name}', generate a catchy title, a creative description, and a list of 10-15 keywords. YOUR RESPONSE MUST BE A SINGLE, VALID, RAW JSON OBJECT."""
-    retries = 0; max_retries = 3; delay = 30
+    retries = 0; max_retries = 3
     while retries < max_retries:
         try:
-            response = client.chat.completions.create(model="deepseek/deepseek-r1-0528-qwen3-8b:free", messages=[
+            content = client.chat(METADATA_MODEL, [
                       {"role": "system", "content": "Generate metadata in JSON format: {'original_file_name':'name','title':'title','description':'desc','tags':'tag1,tag2'}"},
-                      {"role": "user", "content": prompt}], response_format={"type": "json_object"})
-            parsed_data = safe_json_load_and_clean(response.choices[0].message.content)
+                      {"role": "user", "content": prompt}], validate=lambda c: (safe_json_load_and_clean(c) or {}).get('title'), response_format={"type": "json_object"})
+            parsed_data = safe_json_load_and_clean(content)
             if parsed_data and parsed_data.get('title'): return parsed_data
             else: raise ValueError("LLM returned unusable or invalid JSON.")
         except Exception as e:
             print(f"Metadata generation failed: {e}"); retries += 1
-            if retries < max_retries: time.sleep(delay); delay *= 1.5
+            if retries < max_retries: time.sleep(SCHEDULER.backoff_delay(retries - 1))
     return None
 
-def upload_video_to_youtube(youtube_service, video_path, title, description, tags):
-    """Uploads a local video file to YouTube."""
+def upload_checkpoint_path(video_path):
+    return f"{video_path}.upload.json"
+
+def load_upload_checkpoint(video_path):
+    """Returns the saved resumable upload session for this exact file (same size and mtime), or None."""
+    try:
+        with open(upload_checkpoint_path(video_path)) as f: checkpoint = json.load(f)
+        stat = os.stat(video_path)
+    except (OSError, ValueError): return None
+    if checkpoint.get('size') != stat.st_size or checkpoint.get('mtime') != stat.st_mtime: return None
+    return checkpoint
+
+def save_upload_checkpoint(video_path, resumable_uri, offset):
+    """Saves the resumable session URI and the bytes the server has confirmed so far."""
+    stat = os.stat(video_path)
+    checkpoint = {'resumable_uri': resumable_uri, 'offset': offset, 'size': stat.st_size, 'mtime': stat.st_mtime, 'saved_at': time.time()}
+    tmp_path = f"{upload_checkpoint_path(video_path)}.tmp"
+    with open(tmp_path, 'w') as f: json.dump(checkpoint, f)
+    os.replace(tmp_path, upload_checkpoint_path(video_path))
+
+@instrumented
+def upload_video_to_youtube(youtube_service, video_path, title, description, tags, stats=None):
+    """Uploads a local video file to YouTube in UPLOAD_CHUNK_SIZE chunks.
+
+    The session URI and confirmed offset are checkpointed after every chunk, so an interrupted upload
+    (even in an earlier process) continues where it stopped. Throughput and retries are printed and,
+    if `stats` is given, stored in it."""
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaFileUpload
     body = {'snippet': {'title': title, 'description': description, 'tags': [t.strip() for t in tags.split(',')] if tags else [], 'categoryId': '27'},
             'status': {'privacyStatus': 'public'}}
-    media = MediaFileUpload(video_path, chunksize=-1, resumable=True)
+    media = MediaFileUpload(video_path, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
     try:
-        print(f"Starting YouTube upload for '{os.path.basename(video_path)}'...")
         request = youtube_service.videos().insert(part=','.join(body.keys()), body=body, media_body=media)
-        response = request.execute()
-        print("Video uploaded successfully!")
+        checkpoint = load_upload_checkpoint(video_path)
+        # Resuming relies on this private flag; without it the server would reject the checkpoint's offset
+        if checkpoint and not hasattr(request, '_in_error_state'):
+            print("  -> This googleapiclient version can't resume uploads (HttpRequest has no _in_error_state); starting over.")
+            cleanup_intermediate_files([upload_checkpoint_path(video_path)])
+            checkpoint = None
+        if checkpoint:
+            print(f"Resuming YouTube upload for '{os.path.basename(video_path)}' ({checkpoint['offset'] / 1e6:.1f} MB already sent)...")
+            request.resumable_uri, request.resumable_progress = checkpoint['resumable_uri'], checkpoint['offset']
+            request._in_error_state = True # Makes the client ask the server for the confirmed offset before sending more
+        else: print(f"Starting YouTube upload for '{os.path.basename(video_path)}'...")
+
+        total_bytes, start_offset = media.size(), request.resumable_progress
+        started, response, failures, retries = time.monotonic(), None, 0, 0
+        while response is None:
+            operation = 'videos.insert' if request.resumable_uri is None else 'videos.insert.chunk'
+            try:
+                status, response = SCHEDULER.call('youtube', request.next_chunk, operation=operation, max_retries=0)
+            except Exception as e:
+                expired = isinstance(e, HttpError) and e.resp.status in (404, 410) and request.resumable_uri is not None
+                retryable, retry_after = (True, 0) if expired else classify_error(e)
+                if not retryable or failures == MAX_RETRIES: raise
+                if expired: # Sessions expire after about a week; start over with a new one
+                    print("  -> Upload session expired; starting a new one.")
+                    request.resumable_uri, request.resumable_progress, request._in_error_state = None, 0, False
+                    cleanup_intermediate_files([upload_checkpoint_path(video_path)])
+                delay = max(retry_after or 0, SCHEDULER.backoff_delay(failures))
+                failures += 1; retries += 1
+                span_add(retries=1)
+                print(f"  -> Upload chunk failed ({e.__class__.__name__}); retry {failures}/{MAX_RETRIES} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            failures = 0
+            if status:
+                save_upload_checkpoint(video_path, request.resumable_uri, status.resumable_progress)
+                rate = (status.resumable_progress - start_offset) / max(time.monotonic() - started, 1e-6)
+                print(f"  -> Uploaded {status.progress() * 100:.0f}% ({status.resumable_progress / 1e6:.1f}/{total_bytes / 1e6:.1f} MB) at {rate / 1e6:.2f} MB/s")
+
+        cleanup_intermediate_files([upload_checkpoint_path(video_path)])
+        elapsed = time.monotonic() - started
+        sent = total_bytes - start_offset
+        print(f"Video uploaded successfully! {sent / 1e6:.1f} MB in {elapsed:.1f}s ({sent / max(elapsed, 1e-6) / 1e6:.2f} MB/s, {retries} retries)")
+        span_add(bytes_out=sent)
+        if stats is not None: stats.update(bytes=sent, seconds=elapsed, retries=retries, resumed_from=start_offset)
         return response['id'] # Return the video ID for thumbnail upload
     except HttpError as e:
         print(f"An HTTP error occurred during YouTube upload:\n{e.content.decode()}")
         return None
+    except QuotaExceededError as e:
+        print(f"YouTube upload skipped: {e}")
+        return None
 
 def cleanup_intermediate_files(files_to_delete):
     """Deletes the specified files."""
@@ -373,20 +1632,806 @@ def cleanup_intermediate_files(files_to_delete):
             try: os.remove(file_path)
             except Exception as e: print(f"  -> ERROR deleting {file_path}: {e}")
 
+SHUTDOWN = threading.Event()
+_render_pools = []
+_fork_lock = threading.Lock() # Held while writing the voiceover through ffmpeg's stdin, and while render processes are forked
+
+def terminate_render_workers():
+    """Kills render worker processes (and their ffmpeg children) of every pipeline."""
+    for pool in _render_pools:
+        for process in list(getattr(pool, '_processes', {}).values()):
+            try: os.killpg(process.pid, signal.SIGKILL)
+            except Exception: process.kill()
+
 def signal_handler(sig, frame):
-    """Gracefully handles Ctrl+C (KeyboardInterrupt)."""
-    print("\n\n👋 Ctrl+C detected! Shutting down gracefully...")
-    sys.exit(0)
+    """Gracefully handles Ctrl+C and SIGTERM: jobs in progress are finished, no new ones start. A second signal quits at once."""
+    name = "Ctrl+C" if sig == signal.SIGINT else signal.Signals(sig).name
+    if SHUTDOWN.is_set():
+        print(f"\n\n👋 Second {name}: quitting now. Unfinished jobs will resume from the journal on the next run.")
+        terminate_render_workers()
+        os._exit(1)
+    SHUTDOWN.set()
+    print(f"\n\n👋 {name} received! Finishing the jobs in progress before shutting down ({name} again to quit now)...")
 
 # ######################################################################
-# #################### PART 4: MAIN EXECUTION ############################
+# #################### PART 4: PRODUCTION PIPELINE #######################
 # ######################################################################
 
-if __name__ == '__main__':
-    
-    # NEW: Register the signal handler for Ctrl+C
-    signal.signal(signal.SIGINT, signal_handler)
+class JobJournal:
+    """Crash-safe record of every job (SQLite): its data and the stages it has finished.
+
+    Each stage is saved as soon as it completes, so after a crash, Ctrl+C or failure the job
+    resumes at its first unfinished stage instead of starting over."""
+
+    def __init__(self, db_path=JOB_JOURNAL_DB):
+        self.db_path = db_path
+        self.held_locks = {}
+        with closing(open_database(db_path)) as db:
+            db.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, video_num INTEGER NOT NULL, state TEXT NOT NULL, job TEXT NOT NULL, updated_at REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, video_num)")
+
+    def save(self, job, state='active'):
+        """Stores the job; state is 'active' (to be resumed), 'finished' or 'abandoned'."""
+        with closing(open_database(self.db_path)) as db:
+            db.execute("INSERT OR REPLACE INTO jobs (job_id, video_num, state, job, updated_at) VALUES (?, ?, ?, ?, ?)",
+                       (job['id'], job['video_num'], state, json.dumps(job), time.time()))
+
+    def discard(self, job):
+        with closing(open_database(self.db_path)) as db:
+            db.execute("DELETE FROM jobs WHERE job_id = ?", (job['id'],))
+
+    def unfinished(self):
+        """Returns the jobs still to be resumed, oldest first."""
+        with closing(open_database(self.db_path)) as db:
+            return [json.loads(row[0]) for row in db.execute("SELECT job FROM jobs WHERE state = 'active' ORDER BY video_num")]
+
+    def counts(self):
+        """Returns how many jobs are in each state ('active', 'finished', 'abandoned')."""
+        with closing(open_database(self.db_path)) as db:
+            return dict(db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    def last_video_num(self):
+        with closing(open_database(self.db_path)) as db:
+            return db.execute("SELECT COALESCE(MAX(video_num), 0) FROM jobs").fetchone()[0]
+
+    def hold(self, stage, wait=False):
+        """Takes this journal's lock for a stage ('render' or 'upload') until the process exits. False if another process has it.
+
+        A pipeline holds both, so a `render` or `upload` command can't pick up the active jobs it is working on."""
+        if stage in self.held_locks: return True
+        try: import fcntl
+        except ImportError: return True # No flock (Windows): don't run `render` or `upload` beside `run` there
+        lock_file = open(f"{self.db_path}.{stage}.lock", 'a')
+        try: fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except OSError:
+            lock_file.close(); return False
+        self.held_locks[stage] = lock_file # The OS releases it when the process ends, even after a crash
+        return True
+
+def create_job(video_num):
+    """Creates a job record and its private scratch directory. The job keeps this run's ENCODING_PROFILE, which render workers can't be relied on to share."""
+    job_id = f"video_{video_num}_{int(time.time() * 1000)}"
+    work_dir = os.path.join(JOBS_FOLDER, job_id)
+    os.makedirs(work_dir, exist_ok=True)
+    return {'id': job_id, 'video_num': video_num, 'work_dir': work_dir, 'image_folder': os.path.join(work_dir, "stock_images"),
+            'profile': ENCODING_PROFILE, 'done': [], 'attempts': 0}
+
+def stage_done(job, stage):
+    return stage in job.get('done', [])
+
+def complete_stage(job, stage, journal=None):
+    """Marks a stage as finished and, with a journal, persists the job right away."""
+    if stage not in job.setdefault('done', []): job['done'].append(stage)
+    if journal: journal.save(job)
+
+def reset_stage(job, stage):
+    """Forgets a finished stage (e.g. its output file is gone), so it runs again."""
+    if stage in job.get('done', []): job['done'].remove(stage)
+
+def already_rendered(job):
+    """True when a resumed job doesn't need its video (re-)rendered."""
+    return stage_done(job, 'upload') or (stage_done(job, 'render') and os.path.exists(job.get('final_video_path') or ''))
+
+@instrumented
+def prepare_job(job, used_topics, topic_lock=None, journal=None, processed_video_hashes=None):
+    """Stage 1 (I/O-bound): topic, script, visual prompts, stock images and voiceover. Finished stages are skipped.
+
+    Sets job['status'] to 'prepared', 'no_topic', 'duplicate' (content fingerprint already uploaded) or 'failed'."""
+    if already_rendered(job):
+        job['status'] = 'prepared'; return job
+    if not stage_done(job, 'topic'):
+        with topic_lock or threading.Lock():
+            trending_topic = get_trending_topic(YOUTUBE_API_KEY, used_topics)
+        if not trending_topic:
+            print("Failed to find a unique trending topic.")
+            job['status'] = 'no_topic'; return job
+        print(f"[Video #{job['video_num']}] Found a trending topic: '{trending_topic}'")
+        job['topic'] = trending_topic
+        complete_stage(job, 'topic', journal)
+    trending_topic = job['topic']
+
+    if not stage_done(job, 'content'):
+        package = generate_video_package(trending_topic) if USE_COMBINED_LLM_CALL else None
+        script = package['script'] if package else generate_script(trending_topic)
+        if not script:
+            job['status'] = 'failed'; return job
+        job['script'] = script
+        job['script_lines'] = [line.strip() for line in script.split('.') if line.strip()] 
+        if package and package['visual_queries']:
+            job['visual_prompts'] = package['visual_queries']
+            job['metadata'], job['thumbnail_text'] = package['metadata'], package['thumbnail_text']
+        else:
+            # Separate calls: visual queries and metadata don't depend on each other, so request them together
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                prompts_future = executor.submit(in_caller_context(generate_visual_prompts), script, len(job['script_lines']))
+                metadata_future = executor.submit(in_caller_context(get_video_metadata), llm, get_final_video_filename(trending_topic, job['video_num'], job.get('profile')))
+                job['visual_prompts'] = prompts_future.result()
+                job['metadata'] = metadata_future.result()
+        job['content_fingerprint'] = content_fingerprint(trending_topic, script)
+        complete_stage(job, 'content', journal)
+
+    if DEDUP_CONTENT_PRECHECK and processed_video_hashes is not None and job.get('content_fingerprint') in processed_video_hashes:
+        print(f"[Video #{job['video_num']}] Same topic and script were already uploaded (fingerprint found). Skipping render.")
+        job['status'] = 'duplicate'; return job
+
+    if not os.path.isdir(job['image_folder']): reset_stage(job, 'assets')
+    if not stage_done(job, 'assets'):
+        download_stock_images(job['visual_prompts'], job['image_folder'])
+        os.makedirs(job['image_folder'], exist_ok=True)
+        if KEN_BURNS_BACKEND == "numpy": preprocess_images(job['image_folder']) # Decode and scale here, not in the render worker
+        complete_stage(job, 'assets', journal)
+
+    if not os.path.exists(job.get('voiceover_path') or ''): reset_stage(job, 'voiceover')
+    if not stage_done(job, 'voiceover'):
+        job['voiceover_path'] = create_text_and_voiceover(job['script_lines'], os.path.join(job['work_dir'], "voiceover.mp3"))
+        complete_stage(job, 'voiceover', journal)
+    job['status'] = 'prepared'
+    return job
+
+@instrumented
+def render_job(job):
+    """Stage 2 (CPU-bound): renders the final video. Runs in a worker process, so it only takes and returns plain data."""
+    print(f"[Video #{job['video_num']}] Rendering in process {os.getpid()} (e.g. py-spy record -p {os.getpid()})...")
+    final_video_path, render_files = render_video(job['voiceover_path'], job['script_lines'], job['topic'], job['video_num'],
+                                                  image_folder=job['image_folder'], work_dir=job['work_dir'], profile=job.get('profile'))
+    job['final_video_path'] = final_video_path
+    job['intermediate_files'] = [job['voiceover_path'], voiceover_segments_path(job['voiceover_path'])] + render_files
+    job['status'] = 'rendered' if final_video_path and os.path.exists(final_video_path) else 'failed'
+    if job['status'] == 'rendered': complete_stage(job, 'render') # The parent process journals the result
+    else: print(f"Video #{job['video_num']} failed to compile. Skipping upload.")
+    return job
+
+def run_render_job(job):
+    """Render worker entry point: renders a job (under cProfile with PROFILE_RENDER) and hands its spans back in job['render_spans']."""
+    profiler = cProfile.Profile() if PROFILE_RENDER else None
+    if profiler: profiler.enable()
+    try:
+        with job_context(job): job = render_job(job)
+    finally:
+        if profiler:
+            profiler.disable()
+            os.makedirs(METRICS_FOLDER, exist_ok=True)
+            profile_path = os.path.join(METRICS_FOLDER, f"{job['id']}.render.prof")
+            profiler.dump_stats(profile_path)
+            print(f"  -> Render profile saved to {profile_path} (python -m pstats {profile_path})")
+    job['render_spans'] = METRICS.drain()
+    return job
+
+@instrumented
+def publish_job(job, youtube_service, uploader_client, processed_video_hashes, journal=None):
+    """Stage 3 (I/O-bound): hash check, metadata, upload and thumbnail. Finished stages are skipped.
+
+    Sets job['status'] to 'uploaded', 'duplicate' or 'failed'. A failed job keeps its final video so it can be retried."""
+    final_video_path = job['final_video_path']
+    intermediate_files = job['intermediate_files'] + [hash_sidecar_path(final_video_path)]
+
+    if not stage_done(job, 'upload'):
+        # 1. Hash Check (Uniqueness) - usually hashed while encoding, so the file isn't read again
+        file_content_hash = get_video_hash(final_video_path)
+        if file_content_hash in processed_video_hashes:
+             print(f"Video {final_video_path} already uploaded (Hash found). Deleting local file and skipping.")
+             os.remove(final_video_path)
+             cleanup_intermediate_files(intermediate_files)
+             job['status'] = 'duplicate'; return job
+        job['file_hash'] = file_content_hash
+
+        # 2. Get Metadata (usually already generated during preparation)
+        if not stage_done(job, 'metadata'):
+            job['metadata'] = job.get('metadata') or get_video_metadata(uploader_client, os.path.basename(final_video_path))
+            if not job['metadata']:
+                print(f"Failed to get metadata. Keeping the rendered video to retry later.")
+                job['status'] = 'failed'; return job
+            complete_stage(job, 'metadata', journal)
+        metadata = job['metadata']
+
+        # 3. Upload (waits for the daily reset rather than failing when the quota can't cover it)
+        SCHEDULER.wait_for_youtube_quota(YOUTUBE_UNITS_PER_VIDEO - YOUTUBE_QUOTA_COSTS['videos.list'])
+        video_id = upload_video_to_youtube(
+            youtube_service, 
+            final_video_path, 
+            metadata.get('title'), 
+            metadata.get('description'), 
+            metadata.get('tags'),
+            stats=job.setdefault('upload_stats', {})
+        )
+        if not video_id:
+            print(f"WARNING: YouTube upload failed for {final_video_path}. Keeping final video for manual review/retry.")
+            job['status'] = 'failed'; return job
+        job['video_id'] = video_id
+        complete_stage(job, 'upload', journal) # Journaled at once: an uploaded video is never uploaded again
+        processed_video_hashes.add(file_content_hash)
+        if job.get('content_fingerprint'): processed_video_hashes.add(job['content_fingerprint'], kind='content')
+        print(f"Successfully uploaded and logged hash {file_content_hash[:10]}... for {final_video_path}.")
+
+    # 4. Thumbnail and Final Cleanup
+    if not stage_done(job, 'thumbnail'):
+        job['thumbnail_set'] = generate_and_set_thumbnail(uploader_client, youtube_service, job['video_id'], job['metadata'].get('title'), job.get('thumbnail_text'))
+        complete_stage(job, 'thumbnail', journal)
+    print(f"  -> {SCHEDULER.quota_report()}")
+    cleanup_intermediate_files(intermediate_files + [final_video_path])
+    job['status'] = 'uploaded'
+    return job
+
+def discard_job(job):
+    """Removes a job's scratch directory. A final video still in it (its upload failed) is moved to the current directory for manual review."""
+    final_video_path = job.get('final_video_path')
+    if final_video_path and os.path.exists(final_video_path) and os.path.dirname(os.path.abspath(final_video_path)) == os.path.abspath(job['work_dir']):
+        shutil.move(final_video_path, os.path.basename(final_video_path))
+    shutil.rmtree(job['work_dir'], ignore_errors=True)
+
+def finish_job(job, journal):
+    """Journals a job that left the pipeline: finished (uploaded or duplicate), dropped (no topic) or failed.
+
+    A failed job stays active, to be retried from its first unfinished stage, until JOB_MAX_ATTEMPTS is reached."""
+    status = job.get('status')
+    if status in ('uploaded', 'duplicate'):
+        journal.save(job, 'finished'); discard_job(job)
+    elif status == 'no_topic':
+        journal.discard(job); discard_job(job)
+    else:
+        job['attempts'] = job.get('attempts', 0) + 1
+        if job['attempts'] >= JOB_MAX_ATTEMPTS:
+            print(f"[Video #{job['video_num']}] Giving up after {job['attempts']} attempts.")
+            journal.save(job, 'abandoned'); discard_job(job)
+        else: journal.save(job)
+
+def _init_render_worker():
+    """Render processes leave Ctrl+C to the main process, which drains them instead of killing renders midway."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL) # Forked after signal_handler was registered; the pool terminates broken workers with SIGTERM
+    if hasattr(os, 'setsid'):
+        try: os.setsid() # Own process group: the terminal's SIGINT doesn't reach this worker's ffmpeg either
+        except OSError: pass
+    METRICS.unreported = [] # Spans go back to the main process with each rendered job
+
+def render_in_child(job):
+    """Renders a job in a one-off render worker process (its own session, see _init_render_worker), so a Ctrl+C
+    meant for this process lets the render finish instead of killing its ffmpeg. Returns the rendered job."""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=_init_render_worker) as pool:
+        _render_pools.append(pool) # A second Ctrl+C still kills it
+        try: job = pool.submit(run_render_job, job).result()
+        finally: _render_pools.remove(pool)
+    METRICS.merge(job.pop('render_spans', []))
+    return job
+
+class ProductionPipeline:
+    """Runs prepare -> render -> publish with bounded queues between the stages.
 
+    Preparation and publishing run on threads, renders run in a process pool, so the
+    next video is prepared and rendered while the previous one uploads. Every finished
+    stage is journaled; unfinished jobs from earlier runs and failed jobs are resumed at
+    their first unfinished stage."""
+
+    def __init__(self, youtube_service, uploader_client, processed_video_hashes, used_topics=USED_TOPICS,
+                 prep_workers=PREP_WORKERS, render_workers=RENDER_WORKERS, upload_workers=UPLOAD_WORKERS, queue_size=PIPELINE_QUEUE_SIZE,
+                 journal=None):
+        self.youtube_service = youtube_service
+        self.uploader_client = uploader_client
+        self.processed_video_hashes = processed_video_hashes
+        self.used_topics = used_topics
+        self.prep_workers, self.render_workers, self.upload_workers = prep_workers, render_workers, upload_workers
+        self.queue_size = queue_size
+        self.render_pool = self._start_render_pool()
+        self.journal = journal or JobJournal()
+        for stage in ('render', 'upload'):
+            if not self.journal.hold(stage):
+                print(f"Waiting for the `{stage}` command that is using {self.journal.db_path} to finish...")
+                self.journal.hold(stage, wait=True)
+        self.topic_lock = threading.Lock()
+        self.state = threading.Condition()
+        self.pending = collections.deque(self.journal.unfinished()) # Jobs to resume before starting new ones
+        if self.pending: print(f"Resuming {len(self.pending)} unfinished job(s) from {self.journal.db_path}.")
+        self.next_video_num = self.journal.last_video_num() + 1
+        self.consecutive_failures = 0
+
+    def run_batch(self, target=VIDEOS_PER_BATCH):
+        """Produces videos until `target` of them are uploaded (or skipped as duplicates). Returns that count.
+
+        After a shutdown request no new jobs start; the ones in progress are finished."""
+        self.completed, self.in_flight, self.topics_exhausted, self.target = 0, 0, False, target
+        render_queue = queue.Queue(maxsize=self.queue_size)
+        upload_queue = queue.Queue(maxsize=self.queue_size)
+
+        prep_threads = self._start(self.prep_workers, self._prep_loop, render_queue)
+        render_threads = self._start(self.render_workers, self._render_loop, render_queue, upload_queue)
+        upload_threads = self._start(self.upload_workers, self._upload_loop, upload_queue)
+
+        for stage_threads, stage_queue, workers in ((prep_threads, render_queue, self.render_workers),
+                                                    (render_threads, upload_queue, self.upload_workers),
+                                                    (upload_threads, None, 0)):
+            for t in stage_threads: t.join()
+            for _ in range(workers): stage_queue.put(None) # Tell the next stage nothing more is coming
+        return self.completed
+
+    def close(self):
+        """Shuts down the render process pool and writes the final metrics summary."""
+        self.render_pool.shutdown(wait=True)
+        METRICS.write_prometheus()
+
+    def _start_render_pool(self):
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.render_workers, initializer=_init_render_worker)
+        with _fork_lock: pool.submit(os.getpid).result() # Fork the render processes now: forked later, they would inherit pipes (e.g. a voiceover ffmpeg's stdin) open in prep threads and keep them from closing
+        _render_pools.append(pool)
+        return pool
+
+    def _replace_render_pool(self, broken_pool):
+        """Starts a new render pool after a render process died (OOM kill, segfault), which breaks its pool for good."""
+        with self.state:
+            if self.render_pool is not broken_pool: return # Another render thread already replaced it
+            print("  -> A render process died. Starting a new render pool.")
+            _render_pools.remove(broken_pool)
+            broken_pool.shutdown(wait=False)
+            self.render_pool = self._start_render_pool()
+
+    def _start(self, count, target, *args):
+        threads = [threading.Thread(target=target, args=args, daemon=True) for _ in range(count)]
+        for t in threads: t.start()
+        return threads
+
+    def _claim_job(self):
+        """Blocks until another job is needed; returns a resumed job or a new one, or None when the batch is covered."""
+        with self.state:
+            while True:
+                if self.completed >= self.target or self.topics_exhausted or SHUTDOWN.is_set(): return None
+                if self.completed + self.in_flight < self.target:
+                    self.in_flight += 1
+                    if self.pending: return self.pending.popleft()
+                    video_num = self.next_video_num; self.next_video_num += 1
+                    break
+                self.state.wait(timeout=1)
+        job = create_job(video_num)
+        self.journal.save(job)
+        return job
+
+    def _finish(self, job):
+        """Releases a job's slot; only uploaded or duplicate videos count towards the batch.
+
+        Failed jobs stay in the journal and are queued again until JOB_MAX_ATTEMPTS is reached."""
+        status = job.get('status')
+        finish_job(job, self.journal)
+        with self.state:
+            self.in_flight -= 1
+            if status in ('uploaded', 'duplicate'): self.completed += 1; self.consecutive_failures = 0
+            if status == 'failed':
+                self.consecutive_failures += 1
+                if job['attempts'] < JOB_MAX_ATTEMPTS: self.pending.append(job)
+            if status == 'no_topic': self.topics_exhausted = True
+            self.state.notify_all()
+        METRICS.write_prometheus()
+
+    def _pause_after_failure(self):
+        """Backs off exponentially (with jitter) while jobs keep failing, instead of a fixed sleep."""
+        SHUTDOWN.wait(SCHEDULER.backoff_delay(max(0, self.consecutive_failures - 1)))
+
+    def _prep_loop(self, render_queue):
+        while True:
+            job = self._claim_job()
+            if job is None: return
+            print(f"\n--- Processing Video #{job['video_num']}{' (resumed)' if job.get('done') else ''} ---")
+            try:
+                with job_context(job): prepare_job(job, self.used_topics, self.topic_lock, self.journal, self.processed_video_hashes)
+            except Exception as e:
+                print(f"[Video #{job['video_num']}] Preparation failed: {e}"); job['status'] = 'failed'
+            if job['status'] == 'prepared': render_queue.put(job)
+            else:
+                self._finish(job)
+                if job['status'] == 'failed': self._pause_after_failure()
+
+    def _render_loop(self, render_queue, upload_queue):
+        while True:
+            job = render_queue.get()
+            if job is None: return
+            if already_rendered(job):
+                job['status'] = 'rendered' # Already rendered before a restart or retry
+            else:
+                reset_stage(job, 'render')
+                for crash in range(1, JOB_MAX_ATTEMPTS + 1):
+                    pool = self.render_pool
+                    try:
+                        job = pool.submit(run_render_job, job).result()
+                        METRICS.merge(job.pop('render_spans', []))
+                    except concurrent.futures.process.BrokenProcessPool as e:
+                        # Not the job's fault as such (every render in flight fails with it), so it isn't an attempt: render it again
+                        self._replace_render_pool(pool)
+                        if crash < JOB_MAX_ATTEMPTS: continue
+                        print(f"[Video #{job['video_num']}] Render process died {crash} times: {e}"); job['status'] = 'failed'
+                    except Exception as e:
+                        print(f"[Video #{job['video_num']}] Render worker failed: {e}"); job['status'] = 'failed'
+                    break
+            if job['status'] == 'rendered':
+                self.journal.save(job)
+                upload_queue.put(job)
+            else:
+                self._finish(job); self._pause_after_failure()
+
+    def _upload_loop(self, upload_queue):
+        while True:
+            job = upload_queue.get()
+            if job is None: return
+            try:
+                with job_context(job): publish_job(job, self.youtube_service, self.uploader_client, self.processed_video_hashes, self.journal)
+            except Exception as e:
+                print(f"[Video #{job['video_num']}] Publishing failed: {e}"); job['status'] = 'failed'
+            self._finish(job)
+            if job['status'] == 'failed': self._pause_after_failure()
+
+class JobSpool:
+    """Durable job queue made of files, shared by worker processes on one or several hosts (SPOOL_FOLDER on a shared directory).
+
+    A job is a JSON file in <kind>/ready, leased, done or failed. A worker claims one by renaming it into leased/
+    under its own id (the rename is atomic, so only one claimer wins) and heartbeats by touching that file. A lease
+    that isn't touched for QUEUE_VISIBILITY_TIMEOUT seconds (the worker crashed or lost its host) goes back to ready/.
+    Timeouts compare file times with the local clock, so hosts sharing a spool should keep their clocks in sync."""
+
+    STATES = ('ready', 'leased', 'done', 'failed')
+
+    def __init__(self, folder=SPOOL_FOLDER, kinds=QUEUE_KINDS, visibility_timeout=QUEUE_VISIBILITY_TIMEOUT):
+        self.folder, self.kinds, self.visibility_timeout = folder, kinds, visibility_timeout
+        for kind in kinds:
+            for state in self.STATES + ('tmp',): os.makedirs(os.path.join(folder, kind, state), exist_ok=True)
+        os.makedirs(os.path.join(folder, 'workers'), exist_ok=True)
+
+    def path(self, kind, state, name):
+        return os.path.join(self.folder, kind, state, name)
+
+    def write(self, path, data):
+        """Writes JSON atomically: a temporary file in the same folder tree, then a rename."""
+        tmp_path = os.path.join(os.path.dirname(os.path.dirname(path)), 'tmp', f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w') as f: json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def listing(self, kind, state):
+        """(mtime, name, path) of the job files in a state, oldest first. Files that vanish meanwhile are skipped."""
+        entries = []
+        with os.scandir(os.path.join(self.folder, kind, state)) as it:
+            for entry in it:
+                if not entry.name.endswith('.json'): continue
+                try: entries.append((entry.stat().st_mtime, entry.name, entry.path))
+                except FileNotFoundError: pass # Claimed or moved by another worker
+        return sorted(entries)
+
+    def put(self, kind, job):
+        """Queues a job for `kind` workers."""
+        self.write(self.path(kind, 'ready', f"{job['id']}.json"), job)
+
+    def claim(self, kind, worker_id, on_heartbeat=None):
+        """Leases the oldest ready job of a kind. Returns a Lease, or None when there is nothing to do."""
+        self.requeue_expired(kind)
+        for _, name, path in self.listing(kind, 'ready'):
+            lease_path = self.path(kind, 'leased', f"{name[:-len('.json')]}@{worker_id}.json")
+            try:
+                os.utime(path) # The lease starts now: renamed with the time it was queued, it could look expired at once
+                os.rename(path, lease_path)
+                with open(lease_path) as f: job = json.load(f)
+            except FileNotFoundError: continue # Another worker got it first
+            return Lease(self, kind, lease_path, job, on_heartbeat)
+        return None
+
+    def requeue_expired(self, kind):
+        """Puts leases whose worker stopped heartbeating back in ready/. Returns how many."""
+        requeued, now = 0, time.time()
+        for mtime, name, path in self.listing(kind, 'leased'):
+            if now - mtime <= self.visibility_timeout: continue
+            try: os.rename(path, self.path(kind, 'ready', f"{name.split('@')[0]}.json"))
+            except FileNotFoundError: continue # Finished, or requeued by another worker
+            print(f"  -> Lease {kind}/{name} expired after {now - mtime:.0f}s without a heartbeat. Job requeued.")
+            requeued += 1
+        return requeued
+
+    def holders(self, kind, job_id):
+        """Paths of every copy of a job in a queue: leases of any worker, then ready/, done/ and failed/."""
+        leased = [path for _, name, path in self.listing(kind, 'leased') if name.split('@')[0] == job_id]
+        return set(leased + [path for path in (self.path(kind, state, f"{job_id}.json") for state in ('ready', 'done', 'failed')) if os.path.exists(path)])
+
+    def last_video_num(self):
+        """Highest video number of any job in the spool (job ids are video_<num>_<ms>)."""
+        matches = [re.match(r"video_(\d+)_", name) for kind in self.kinds for state in self.STATES for _, name, _ in self.listing(kind, state)]
+        return max([int(m.group(1)) for m in matches if m] + [0])
+
+    def depth(self):
+        """{kind: {state: count, 'oldest_ready_seconds': age}} for every queue."""
+        now, depths = time.time(), {}
+        for kind in self.kinds:
+            listings = {state: self.listing(kind, state) for state in self.STATES}
+            depths[kind] = {state: len(entries) for state, entries in listings.items()}
+            depths[kind]['oldest_ready_seconds'] = now - listings['ready'][0][0] if listings['ready'] else 0
+        return depths
+
+    def workers(self):
+        """Status records written by WorkerStatus, one per worker process that ever ran on this spool."""
+        records = []
+        for name in sorted(os.listdir(os.path.join(self.folder, 'workers'))):
+            if not name.endswith('.json'): continue
+            try:
+                with open(os.path.join(self.folder, 'workers', name)) as f: records.append(json.load(f))
+            except (OSError, JSONDecodeError): pass # Being replaced right now
+        return records
+
+class Lease:
+    """A claimed job. A thread touches the lease file every QUEUE_HEARTBEAT_SECONDS until it is released.
+
+    It also acts as the job's journal (complete_stage calls save()), so a job handed to another worker
+    resumes at its first unfinished stage. If the lease expired and the job went to another worker,
+    `lost` is set and the job is neither saved nor released any more."""
+
+    def __init__(self, spool, kind, path, job, on_heartbeat=None):
+        self.spool, self.kind, self.path, self.job = spool, kind, path, job
+        self.on_heartbeat, self.lost = on_heartbeat, False
+        self.released = threading.Event()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+
+    def _heartbeat(self):
+        while not self.released.wait(QUEUE_HEARTBEAT_SECONDS):
+            try: os.utime(self.path)
+            except FileNotFoundError:
+                self.lost = True
+                print(f"WARNING: Lost the lease on {self.kind} job {self.job['id']}; another worker has it now.")
+                return
+            if self.on_heartbeat: self.on_heartbeat()
+
+    def save(self, job, state='active'):
+        """Persists the job's progress in the lease file.
+
+        The lease may expire between the check and the write, which then recreates it beside the requeued
+        copy; the write is therefore checked afterwards, and a recreated lease is removed again."""
+        if self.lost or not os.path.exists(self.path):
+            self.lost = True; return
+        self.spool.write(self.path, job)
+        if self.spool.holders(self.kind, job['id']) - {self.path}:
+            self.lost = True
+            try: os.remove(self.path)
+            except FileNotFoundError: pass
+            print(f"WARNING: Lost the lease on {self.kind} job {job['id']} while saving it; another worker has it now.")
+
+    def release(self, state, next_kind=None):
+        """Ends the lease: the job goes to done/, failed/ or back to ready/, after being queued for `next_kind` if given.
+
+        Returns False if the lease was lost (the job then belongs to whichever worker holds it now)."""
+        self.released.set()
+        self.save(self.job)
+        if self.lost: return False
+        if next_kind: self.spool.put(next_kind, self.job) # Before leaving leased/: a crash in between repeats the job rather than losing it
+        try: os.rename(self.path, self.spool.path(self.kind, state, f"{self.job['id']}.json"))
+        except FileNotFoundError:
+            self.lost = True; return False
+        return True
+
+class WorkerStatus:
+    """This worker's record in SPOOL_FOLDER/workers/<worker id>.json: kind, host, jobs done and failed, busy time."""
+
+    def __init__(self, spool, kind):
+        self.id = f"{socket.gethostname()}-{os.getpid()}"
+        self.path = os.path.join(spool.folder, 'workers', f"{self.id}.json")
+        self.lock = threading.Lock()
+        now = time.time()
+        self.record = {'worker': self.id, 'kind': kind, 'host': socket.gethostname(), 'pid': os.getpid(), 'started_at': now,
+                       'updated_at': now, 'state': 'idle', 'job': None, 'job_started_at': None, 'done': 0, 'failed': 0, 'busy_seconds': 0.0}
+        self.update()
+
+    def update(self, **changes):
+        """Applies changes and rewrites the record atomically (also called on every lease heartbeat)."""
+        with self.lock:
+            self.record.update(changes, updated_at=time.time())
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f: json.dump(self.record, f)
+            os.replace(tmp_path, self.path)
+
+    def start_job(self, job):
+        self.update(state='busy', job=job['id'], job_started_at=time.time())
+
+    def finish_job(self, outcome):
+        """Counts a job as 'done' or 'failed' and adds its duration to the busy time."""
+        busy = time.time() - self.record['job_started_at']
+        self.update(state='idle', job=None, job_started_at=None, busy_seconds=self.record['busy_seconds'] + busy,
+                    **{outcome: self.record[outcome] + 1})
+
+QUEUE_NEXT_KIND = {'discover': 'render', 'render': 'upload', 'upload': None}
+QUEUE_SUCCESS_STATUS = {'discover': 'prepared', 'render': 'rendered', 'upload': 'uploaded'}
+
+def enqueue_jobs(count=VIDEOS_PER_BATCH, spool=None):
+    """Queues `count` new jobs for discover workers. Returns them."""
+    spool = spool or JobSpool()
+    first_num = spool.last_video_num() + 1
+    jobs = [create_job(video_num) for video_num in range(first_num, first_num + count)]
+    for job in jobs: spool.put('discover', job)
+    print(f"Queued {count} job(s) for discovery (videos #{first_num}-#{first_num + count - 1}).")
+    return jobs
+
+def run_worker(kind, spool=None, max_jobs=None, exit_when_idle=False):
+    """Claims `kind` jobs from the spool and processes them one at a time until shutdown. Returns how many succeeded.
+
+    discover: topic, script, images and voiceover (queues the job for render); render: the final video (queues it
+    for upload); upload: upload and thumbnail. Run as many workers of each kind as there are cores (render) or
+    spare API quota (discover, upload); render workers may run on other hosts sharing the spool and jobs/ folders.
+    A failed job (or one whose worker died) goes back to the queue until it was claimed JOB_MAX_ATTEMPTS times, then to failed/."""
+    spool = spool or JobSpool()
+    status = WorkerStatus(spool, kind)
+    METRICS.prom_file, METRICS.labels = os.path.join(METRICS_FOLDER, f"analyse-{status.id}.prom"), {'worker': status.id}
+    print(f"{kind.capitalize()} worker {status.id} watching {spool.folder}/{kind} (Ctrl+C to stop after the current job).")
+    processed_video_hashes = get_processed_videos_hashes() if kind in ('discover', 'upload') else None
+    youtube_service = uploader_client = None
+    succeeded = handled = consecutive_failures = 0
+    while not SHUTDOWN.is_set() and (max_jobs is None or handled < max_jobs):
+        lease = spool.claim(kind, status.id, on_heartbeat=status.update)
+        if lease is None:
+            if exit_when_idle: break
+            status.update(); SHUTDOWN.wait(QUEUE_POLL_SECONDS); continue
+        job, handled = lease.job, handled + 1
+        claims = job.setdefault('claims', {})
+        claims[kind] = claims.get(kind, 0) + 1
+        lease.save(job) # Counts the claim before any work, so a job that crashes its worker isn't retried forever
+        if lease.lost:
+            lease.release('ready'); continue
+        status.start_job(job)
+        if claims[kind] > JOB_MAX_ATTEMPTS: # The last claims ended without a release: the job took its worker down
+            print(f"[Video #{job['video_num']}] Giving up on {kind}: claimed {claims[kind] - 1} times without finishing.")
+            if lease.release('failed'): discard_job(job)
+            status.finish_job('failed'); continue
+        print(f"\n--- {kind.capitalize()} Video #{job['video_num']} ({job['id']}, claim {claims[kind]} of {JOB_MAX_ATTEMPTS}) ---")
+        try:
+            with job_context(job):
+                if kind == 'discover':
+                    prepare_job(job, USED_TOPICS, journal=lease, processed_video_hashes=processed_video_hashes)
+                elif kind == 'render':
+                    if already_rendered(job): job['status'] = 'rendered'
+                    else:
+                        reset_stage(job, 'render')
+                        job = lease.job = render_in_child(job)
+                else:
+                    if youtube_service is None: youtube_service, uploader_client = get_authenticated_services(), LLMClient()
+                    publish_job(job, youtube_service, uploader_client, processed_video_hashes, journal=lease)
+        except Exception as e:
+            print(f"[Video #{job['video_num']}] {kind.capitalize()} failed: {e}"); job['status'] = 'failed'
+
+        outcome = job.get('status')
+        if outcome == QUEUE_SUCCESS_STATUS[kind]:
+            released = lease.release('done', QUEUE_NEXT_KIND[kind])
+            if released and kind == 'upload': discard_job(job)
+        elif outcome in ('duplicate', 'no_topic'):
+            if lease.release('done'): discard_job(job)
+        else:
+            gave_up = claims[kind] >= JOB_MAX_ATTEMPTS
+            if gave_up: print(f"[Video #{job['video_num']}] Giving up on {kind} after {claims[kind]} attempts.")
+            if lease.release('failed' if gave_up else 'ready') and gave_up: discard_job(job)
+        succeeded += outcome in (QUEUE_SUCCESS_STATUS[kind], 'duplicate')
+        status.finish_job('done' if outcome in (QUEUE_SUCCESS_STATUS[kind], 'duplicate', 'no_topic') else 'failed')
+        METRICS.write_prometheus()
+        if outcome == 'no_topic': SHUTDOWN.wait(QUEUE_POLL_SECONDS) # Don't hammer the charts while every topic is used
+        consecutive_failures = consecutive_failures + 1 if outcome == 'failed' else 0
+        if consecutive_failures: SHUTDOWN.wait(SCHEDULER.backoff_delay(consecutive_failures - 1))
+    status.update(state='stopped')
+    print(f"{kind.capitalize()} worker {status.id} stopped after {handled} job(s), {succeeded} succeeded.")
+    return succeeded
+
+def queue_status(spool=None, journal=None):
+    """Prints the jobs of the journal (run, render, upload), the depth of every spool queue (worker) and each
+    worker's throughput. Returns (depths, workers, journal_jobs)."""
+    spool = spool or JobSpool()
+    depths, workers, now = spool.depth(), spool.workers(), time.time()
+    journal_jobs = {}
+    if journal or os.path.exists(JOB_JOURNAL_DB): # Don't create a journal for a deployment that only uses workers
+        journal = journal or JobJournal()
+        counts, unfinished = journal.counts(), journal.unfinished()
+        journal_jobs = {'to_render': len(journaled_jobs_for('render', journal)), 'to_upload': len(journaled_jobs_for('upload', journal)),
+                        'finished': counts.get('finished', 0), 'abandoned': counts.get('abandoned', 0)}
+        journal_jobs['to_prepare'] = len(unfinished) - journal_jobs['to_render'] - journal_jobs['to_upload']
+        print(f"Jobs in {journal.db_path} (run, render, upload):")
+        print(f"  {journal_jobs['to_prepare']} to prepare, {journal_jobs['to_render']} to render, {journal_jobs['to_upload']} to upload, "
+              f"{journal_jobs['finished']} finished, {journal_jobs['abandoned']} abandoned\n")
+    print(f"Queues in {spool.folder} (worker):")
+    print(f"  {'kind':<10}{'ready':>7}{'leased':>8}{'done':>7}{'failed':>8}  oldest ready")
+    for kind, depth in depths.items():
+        print(f"  {kind:<10}{depth['ready']:>7}{depth['leased']:>8}{depth['done']:>7}{depth['failed']:>8}  {depth['oldest_ready_seconds']:.0f}s")
+    print(f"\nWorkers ({len(workers)}):")
+    for worker in workers:
+        elapsed = max(worker['updated_at'] - worker['started_at'], 1e-9)
+        if worker['state'] != 'stopped' and now - worker['updated_at'] > spool.visibility_timeout: worker['state'] = 'gone'
+        worker['jobs_per_hour'] = worker['done'] / elapsed * 3600
+        worker['utilization'] = (worker['busy_seconds'] + (worker['updated_at'] - worker['job_started_at'] if worker['job'] else 0)) / elapsed
+        doing = f"on {worker['job']} for {now - worker['job_started_at']:.0f}s" if worker['state'] == 'busy' else worker['state']
+        print(f"  {worker['worker']:<28} {worker['kind']:<9} {worker['done']:>4} done {worker['failed']:>3} failed "
+              f"{worker['jobs_per_hour']:7.1f} jobs/h {worker['utilization']:5.0%} busy  {doing}")
+    return depths, workers, journal_jobs
+
+# ######################################################################
+# #################### PART 5: MAIN EXECUTION ############################
+# ######################################################################
+
+def discover_topics(limit=20):
+    """Prints trending topics that have never been used, without claiming them. Only loads the YouTube client."""
+    titles = TopicProvider(YOUTUBE_API_KEY)._fetch_charts()
+    print(f"{len(titles)} unused trending topics in {', '.join(TRENDING_REGIONS)}{f' (first {limit})' if len(titles) > limit else ''}:")
+    for title in titles[:limit]: print(f"  {title}")
+    return titles
+
+def journaled_jobs_for(stage, journal, job_ids=None):
+    """Unfinished jobs in the journal whose next stage is 'render' (prepared, not rendered) or 'upload' (rendered, not published)."""
+    jobs = [job for job in journal.unfinished() if not job_ids or job['id'] in job_ids]
+    if stage == 'render': return [job for job in jobs if stage_done(job, 'voiceover') and not already_rendered(job)]
+    return [job for job in jobs if already_rendered(job)]
+
+def render_jobs(job_ids=None, journal=None):
+    """Renders the journaled jobs that are prepared but not rendered, one by one in a child process. Returns how many were rendered."""
+    journal = journal or JobJournal()
+    if not journal.hold('render'):
+        print(f"Another process (a pipeline run or `render`) is rendering the jobs in {journal.db_path}. Try again later."); return 0
+    rendered = 0
+    for job in journaled_jobs_for('render', journal, job_ids):
+        if SHUTDOWN.is_set(): break
+        reset_stage(job, 'render')
+        try: job = render_in_child(job)
+        except Exception as e:
+            print(f"[Video #{job['video_num']}] Render failed: {e}"); job['status'] = 'failed'
+        if job['status'] == 'rendered':
+            journal.save(job); rendered += 1
+        else: finish_job(job, journal)
+    print(f"Rendered {rendered} video(s).")
+    METRICS.write_prometheus()
+    return rendered
+
+def upload_jobs(job_ids=None, journal=None):
+    """Publishes the journaled jobs that are rendered but not uploaded (or still lack a thumbnail). Returns how many were uploaded.
+
+    Authenticates only when there is something to upload, and never loads MoviePy, so it is cheap to run from cron."""
+    journal = journal or JobJournal()
+    if not journal.hold('upload'):
+        print(f"Another process (a pipeline run or `upload`) is uploading the jobs in {journal.db_path}. Try again later."); return 0
+    jobs = journaled_jobs_for('upload', journal, job_ids)
+    if not jobs:
+        print("No rendered videos waiting to be uploaded."); return 0
+    youtube_service = get_authenticated_services()
+    uploader_client, processed_video_hashes = LLMClient(), get_processed_videos_hashes()
+    uploaded = 0
+    for job in jobs:
+        if SHUTDOWN.is_set(): break
+        try:
+            with job_context(job): publish_job(job, youtube_service, uploader_client, processed_video_hashes, journal)
+        except Exception as e:
+            print(f"[Video #{job['video_num']}] Publishing failed: {e}"); job['status'] = 'failed'
+        finish_job(job, journal)
+        uploaded += job['status'] == 'uploaded'
+    print(f"Uploaded {uploaded} of {len(jobs)} video(s). {SCHEDULER.quota_report()}")
+    METRICS.write_prometheus()
+    return uploaded
+
+def dedup_check(video_paths=(), topic=None, script=None):
+    """Reports whether videos (by file hash) or a topic and script (by content fingerprint) were already uploaded. True if any was."""
+    processed_video_hashes = get_processed_videos_hashes()
+    found = False
+    for video_path in video_paths:
+        digest = get_video_hash(video_path)
+        if digest is None:
+            print(f"{video_path}: could not be read"); continue
+        found |= digest in processed_video_hashes
+        print(f"{video_path}: {'already uploaded' if digest in processed_video_hashes else 'new'} (sha256 {digest[:12]}...)")
+    if topic and script:
+        fingerprint = content_fingerprint(topic, script)
+        found |= fingerprint in processed_video_hashes
+        print(f"Topic '{topic}' with this script: {'already uploaded' if fingerprint in processed_video_hashes else 'new'}")
+    return found
+
+def run_batches(total_batches=TOTAL_BATCHES, videos_per_batch=VIDEOS_PER_BATCH):
+    """Prepares, renders and uploads videos batch by batch (the default command)."""
     # 1. Initialize Uploader Service
     try:
         youtube_service = get_authenticated_services()
@@ -394,91 +2439,66 @@ if __name__ == '__main__':
         print(f"FATAL: YouTube authentication failed. Check client_secret.json and token.json. Error: {e}")
         sys.exit(1)
 
-    uploader_client = openai.OpenAI(base_url="https://openrouter.ai/api/v1", api_key=OPENROUTER_API_KEY)
+    uploader_client = LLMClient()
     processed_video_hashes = get_processed_videos_hashes()
+    pipeline = ProductionPipeline(youtube_service, uploader_client, processed_video_hashes)
     
-    for batch_num in range(1, TOTAL_BATCHES + 1):
+    for batch_num in range(1, total_batches + 1):
         print(f"\n=======================================================")
-        print(f"| Starting Batch {batch_num} of {TOTAL_BATCHES} ({VIDEOS_PER_BATCH} videos per batch) |")
+        print(f"| Starting Batch {batch_num} of {total_batches} ({videos_per_batch} videos per batch) |")
         print(f"=======================================================")
         
-        videos_in_batch = 0
-        
-        while videos_in_batch < VIDEOS_PER_BATCH:
-            video_num = (batch_num - 1) * VIDEOS_PER_BATCH + (videos_in_batch + 1)
-            print(f"\n--- Processing Video #{video_num} ---")
-            
-            # --- CREATION PHASE ---
-            trending_topic = get_trending_topic(YOUTUBE_API_KEY, USED_TOPICS)
-            if not trending_topic: 
-                print("Failed to find a unique trending topic.")
-                break
-            
-            print(f"Found a trending topic: '{trending_topic}'")
-            script = generate_script(trending_topic)
-            if not script: time.sleep(5); continue
-                
-            script_lines = [line.strip() for line in script.split('.') if line.strip()] 
-            visual_prompts = generate_visual_prompts(script, len(script_lines))
-            download_stock_images(visual_prompts)
-            voiceover_path = create_text_and_voiceover(script)
-            visual_video_path = create_visual_video(voiceover_path, script_lines)
-            final_video_path = compile_final_video(visual_video_path, voiceover_path, trending_topic, video_num)
-            
-            intermediate_files = [voiceover_path, visual_video_path]
-            
-            if not final_video_path or not os.path.exists(final_video_path):
-                print(f"Video #{video_num} failed to compile. Skipping upload.")
-                cleanup_intermediate_files(intermediate_files)
-                time.sleep(5); continue
-            
-            # --- UPLOAD PHASE ---
-            
-            # 2. Hash Check (Uniqueness)
-            file_content_hash = calculate_file_hash(final_video_path, 'sha256')
-            if file_content_hash in processed_video_hashes:
-                 print(f"Video {final_video_path} already uploaded (Hash found). Deleting local file and skipping.")
-                 os.remove(final_video_path)
-                 cleanup_intermediate_files(intermediate_files)
-                 videos_in_batch += 1
-                 continue
-                 
-            # 3. Get Metadata
-            metadata = get_video_metadata(uploader_client, final_video_path)
-
-            if not metadata:
-                print(f"Failed to get metadata. Deleting video and retrying next video.")
-                os.remove(final_video_path)
-                cleanup_intermediate_files(intermediate_files)
-                time.sleep(60); continue
-                
-            # 4. Upload
-            video_id = upload_video_to_youtube(
-                youtube_service, 
-                final_video_path, 
-                metadata.get('title'), 
-                metadata.get('description'), 
-                metadata.get('tags')
-            )
-            
-            # 5. Thumbnail and Final Cleanup
-            if video_id:
-                # NEW: Generate and set thumbnail
-                generate_and_set_thumbnail(uploader_client, youtube_service, video_id, metadata.get('title'))
-                
-                log_processed_video_hash(file_content_hash)
-                print(f"Successfully uploaded and logged hash {file_content_hash[:10]}... for {final_video_path}.")
-                cleanup_intermediate_files(intermediate_files + [final_video_path])
-                videos_in_batch += 1
-            else:
-                print(f"WARNING: YouTube upload failed for {final_video_path}. Keeping final video for manual review/retry.")
-                cleanup_intermediate_files(intermediate_files)
-                time.sleep(5) 
-
-        # Pause between batches
-        if batch_num < TOTAL_BATCHES:
-            pause_time = 600 
-            print(f"\n--- Batch {batch_num} complete. Pausing for {pause_time // 60} minutes... ---")
-            time.sleep(pause_time)
+        videos_in_batch = pipeline.run_batch(videos_per_batch)
+        if videos_in_batch < videos_per_batch and pipeline.topics_exhausted:
+            print(f"Batch {batch_num} ended early: no unique trending topic left ({videos_in_batch}/{videos_per_batch} videos).")
+        if SHUTDOWN.is_set():
+            print("All jobs in progress are finished or journaled. Shutting down.")
+            break
+
+        # Between batches, only wait if the YouTube quota can't cover the next batch
+        print(f"\n--- Batch {batch_num} complete. {SCHEDULER.quota_report()} ---")
+        if batch_num < total_batches:
+            SCHEDULER.wait_for_youtube_quota(videos_per_batch * YOUTUBE_UNITS_PER_VIDEO)
             
-    print("\n\nAll batches complete. Program finished.")
\ No newline at end of file
+    pipeline.close()
+    print("\n\nAll batches complete. Program finished.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Turns trending YouTube topics into narrated videos and uploads them. Without a command, runs the whole pipeline ('run').")
+    subparsers = parser.add_subparsers(dest='command')
+    discover_parser = subparsers.add_parser('discover', help="List trending topics that haven't been used yet")
+    discover_parser.add_argument('--limit', type=int, default=20)
+    render_parser = subparsers.add_parser('render', help="Render journaled jobs that are prepared but not rendered")
+    upload_parser = subparsers.add_parser('upload', help="Upload journaled jobs that are rendered (no MoviePy; suited to cron)")
+    for p in (render_parser, upload_parser): p.add_argument('--job', action='append', dest='job_ids', help="Only this job id (repeatable)")
+    dedup_parser = subparsers.add_parser('dedup-check', help="Check whether videos or a topic + script were already uploaded (exit status 1 if so)")
+    dedup_parser.add_argument('videos', nargs='*', help="Video files to check by hash")
+    dedup_parser.add_argument('--topic')
+    dedup_parser.add_argument('--script')
+    run_parser = subparsers.add_parser('run', help="Prepare, render and upload videos in batches on this machine (the default)")
+    run_parser.add_argument('--batches', type=int, default=TOTAL_BATCHES)
+    run_parser.add_argument('--videos-per-batch', type=int, default=VIDEOS_PER_BATCH)
+    enqueue_parser = subparsers.add_parser('enqueue', help=f"Queue new jobs in {SPOOL_FOLDER}/ for discover workers")
+    enqueue_parser.add_argument('--videos', type=int, default=VIDEOS_PER_BATCH)
+    worker_parser = subparsers.add_parser('worker', help=f"Process queued jobs of one kind; start as many workers as you like, on any host sharing {SPOOL_FOLDER}/ and {JOBS_FOLDER}/")
+    worker_parser.add_argument('kind', choices=QUEUE_KINDS)
+    worker_parser.add_argument('--max-jobs', type=int, help="Stop after this many jobs")
+    worker_parser.add_argument('--exit-when-idle', action='store_true', help="Stop when the queue is empty instead of waiting for jobs")
+    subparsers.add_parser('status', help="Show queue depths and the throughput of every worker")
+    args = parser.parse_args()
+
+    if args.command == 'discover': discover_topics(args.limit)
+    elif args.command == 'enqueue': enqueue_jobs(args.videos)
+    elif args.command == 'status': queue_status()
+    elif args.command == 'dedup-check':
+        if not args.videos and not (args.topic and args.script): parser.error("dedup-check needs video files, or --topic and --script")
+        sys.exit(1 if dedup_check(args.videos, args.topic, args.script) else 0)
+    else:
+        # NEW: Register the signal handler for Ctrl+C, and for SIGTERM from kill, systemd or docker stop
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+        if args.command == 'render': render_jobs(args.job_ids)
+        elif args.command == 'upload': upload_jobs(args.job_ids)
+        elif args.command == 'worker': run_worker(args.kind, max_jobs=args.max_jobs, exit_when_idle=args.exit_when_idle)
+        elif args.command == 'run': run_batches(args.batches, args.videos_per_batch)
+        else: run_batches()
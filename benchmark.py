@@ -0,0 +1,253 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import wave
+import subprocess
+
+import numpy as np
+import openai
+
+import analyse
+import fake_services
+
+# ######################################################################
+# #################### THUMBNAILS: PILLOW vs IMAGEMAGICK #################
+# ######################################################################
+
+SAMPLE_THUMBNAIL_TEXTS = ["YOU WON'T BELIEVE THIS", "SHOCKING NEW TREND", "IT'S FINALLY HERE", "WAIT FOR IT", "THE TRUTH"]
+
+def imagemagick_thumbnail(text, path):
+    """The legacy thumbnail path: one `convert` process per thumbnail, written to disk."""
+    subprocess.run([analyse.IMAGEMAGICK_BINARY, '-size', '1280x720', 'xc:red', '-font', 'Arial-Bold', '-pointsize', '100',
+                    '-fill', 'yellow', '-stroke', 'black', '-strokewidth', '5', '-gravity', 'center', '-annotate', '0', text, path],
+                   check=True, capture_output=True)
+
+def benchmark_thumbnails(count=50):
+    """Times rendering `count` thumbnails with Pillow (one by one and batched) and with ImageMagick."""
+    texts = [SAMPLE_THUMBNAIL_TEXTS[i % len(SAMPLE_THUMBNAIL_TEXTS)] for i in range(count)]
+    analyse.load_thumbnail_template(analyse.THUMBNAIL_TEMPLATE) # Template loading is a one-off cost, like in a real run
+
+    results = {}
+    start = time.perf_counter()
+    for text in texts: analyse.render_thumbnail(text)
+    results['pillow'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    analyse.render_thumbnails(texts)
+    results['pillow (batch)'] = time.perf_counter() - start
+
+    if shutil.which(analyse.IMAGEMAGICK_BINARY) or os.path.exists(analyse.IMAGEMAGICK_BINARY):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            start = time.perf_counter()
+            for i, text in enumerate(texts): imagemagick_thumbnail(text, os.path.join(tmp_dir, f"thumb_{i}.jpg"))
+            results['imagemagick'] = time.perf_counter() - start
+    else:
+        print(f"ImageMagick not found at {analyse.IMAGEMAGICK_BINARY}; skipping the ImageMagick path.")
+
+    print(f"\nThumbnail rendering, {count} thumbnails:")
+    for name, elapsed in results.items():
+        print(f"  {name:<16} {elapsed:8.3f}s total | {elapsed / count * 1000:8.2f} ms/thumbnail")
+    if 'imagemagick' in results:
+        print(f"  Pillow speedup: {results['imagemagick'] / results['pillow']:.1f}x")
+    return results
+
+# ######################################################################
+# #################### ENCODING PROFILES #################################
+# ######################################################################
+
+SAMPLE_SCRIPT_LINES = ["Scientists found something nobody expected", "It changes how we think about the ocean", "And it could be in your kitchen right now", "Here is what you need to know"]
+
+def make_test_composition(folder, seconds=12, image_count=4, size=(1920, 1080)):
+    """Writes synthetic stock images (see fake_services.test_image) and a voiceover WAV."""
+    rng = np.random.default_rng(0)
+    for i in range(image_count): fake_services.test_image(i, size).save(os.path.join(folder, f"image_{i}.jpg"), quality=90)
+    voiceover_path = os.path.join(folder, "voiceover.wav")
+    t = np.arange(int(seconds * 22050)) / 22050
+    voice = (0.3 * np.sin(2 * np.pi * 180 * t) * (1 + np.sin(2 * np.pi * 3 * t)) / 2 + rng.normal(0, 0.02, t.shape)) * 32767
+    with wave.open(voiceover_path, 'wb') as f:
+        f.setnchannels(1); f.setsampwidth(2); f.setframerate(22050)
+        f.writeframes(voice.clip(-32768, 32767).astype(np.int16).tobytes())
+    return voiceover_path
+
+def benchmark_profiles(profiles=None, seconds=12, upload_mbps=20.0):
+    """Encodes the same test composition with each encoding profile and reports encode time, file size and upload savings."""
+    profiles = profiles or list(analyse.ENCODING_PROFILES)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        voiceover_path = make_test_composition(tmp_dir, seconds)
+        cwd = os.getcwd()
+        os.chdir(tmp_dir) # Final videos are written to the working directory
+        try:
+            for profile in profiles:
+                start = time.perf_counter()
+                final_video_path, intermediate_files = analyse.render_video(voiceover_path, SAMPLE_SCRIPT_LINES, "Benchmark", 0, single_pass=True, image_folder=tmp_dir, profile=profile)
+                elapsed = time.perf_counter() - start
+                if not final_video_path: print(f"Profile '{profile}' failed to render."); continue
+                results[profile] = {'seconds': elapsed, 'bytes': os.path.getsize(final_video_path)}
+                analyse.cleanup_intermediate_files(intermediate_files + [final_video_path, analyse.hash_sidecar_path(final_video_path)])
+        finally: os.chdir(cwd)
+
+    baseline = results.get('mezzanine')
+    print(f"\nEncoding profiles, {seconds}s test video at {analyse.VIDEO_SIZE[0]}x{analyse.VIDEO_SIZE[1]} (upload time at {upload_mbps:g} Mbit/s):")
+    for profile, result in results.items():
+        upload_seconds = result['bytes'] * 8 / (upload_mbps * 1e6)
+        savings = f" | {(1 - result['bytes'] / baseline['bytes']) * 100:5.1f}% fewer upload bytes than mezzanine" if baseline and profile != 'mezzanine' else ""
+        print(f"  {profile:<12} encode {result['seconds']:6.1f}s | {result['bytes'] / 1e6:7.2f} MB | upload {upload_seconds:6.1f}s{savings}")
+    return results
+
+def benchmark_render_modes(seconds=12):
+    """Renders the same test composition in two passes (montage, then final video) and in a single pass, and compares the timings."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        voiceover_path = make_test_composition(tmp_dir, seconds)
+        return analyse.compare_render_modes(voiceover_path, SAMPLE_SCRIPT_LINES, "Benchmark", image_folder=tmp_dir, work_dir=tmp_dir)
+
+# ######################################################################
+# #################### END TO END (FAKE SERVICES) ########################
+# ######################################################################
+
+FAKE_SERVICES = ('youtube', 'llm', 'pexels')
+E2E_STAGES = ('prepare_job', 'render_job', 'publish_job')
+
+def git_commit():
+    """The checked-out commit, so results from different commits can be told apart."""
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError: return None
+
+def load_spans(metrics_folder):
+    """Reads every span from the per-job JSONL files in a metrics folder."""
+    spans = []
+    for name in sorted(os.listdir(metrics_folder)) if os.path.isdir(metrics_folder) else []:
+        if name.endswith('.jsonl'):
+            with open(os.path.join(metrics_folder, name)) as f: spans += [json.loads(line) for line in f if line.strip()]
+    return spans
+
+def span_percentiles(spans):
+    """Per span name: calls, errors and the p50/p95/max wall time, stages first, then by total time."""
+    by_name = {}
+    for span in spans: by_name.setdefault(span['span'], []).append(span)
+    order = sorted(by_name, key=lambda name: (name not in E2E_STAGES, E2E_STAGES.index(name) if name in E2E_STAGES else -sum(s['wall_seconds'] for s in by_name[name])))
+    return {name: {'calls': len(by_name[name]), 'errors': sum(s['outcome'] == 'error' for s in by_name[name]),
+                   'p50': float(np.percentile([s['wall_seconds'] for s in by_name[name]], 50)),
+                   'p95': float(np.percentile([s['wall_seconds'] for s in by_name[name]], 95)),
+                   'max': max(s['wall_seconds'] for s in by_name[name])} for name in order}
+
+def start_fake_services(latency, error_rate, stats_path):
+    """Runs `fake_services.py serve` in its own process on free ports, so serving the fakes doesn't compete with the
+    measured pipeline for the GIL. Returns the process and the servers' URLs and settings (by service name)."""
+    command = [sys.executable, fake_services.__file__, 'serve', '--port', '0', '--stats-file', stats_path]
+    for name in FAKE_SERVICES: command += [f'--{name}-latency', str(latency.get(name, 0.0)), f'--{name}-error-rate', str(error_rate.get(name, 0.0))]
+    if os.path.exists(stats_path): os.remove(stats_path)
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while not os.path.exists(stats_path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill(); raise RuntimeError(f"fake_services.py serve didn't start (exit code {process.poll()})")
+        time.sleep(0.05)
+    with open(stats_path) as f: return process, json.load(f)
+
+def stop_fake_services(process, stats_path):
+    """Stops the fakes started by start_fake_services() and returns their final stats, with the request counts."""
+    process.terminate()
+    try: process.wait(timeout=30)
+    except subprocess.TimeoutExpired: process.kill(); process.wait()
+    with open(stats_path) as f: return json.load(f)
+
+def benchmark_e2e(videos=3, latency=None, error_rate=None, render_workers=analyse.RENDER_WORKERS, profile=None, work_dir=None, json_path=None):
+    """Runs `videos` videos through the real pipeline (ProductionPipeline) against local fake YouTube, chat and Pexels
+    servers (started in a separate process), with generated stock photos and the offline TTS engine, and reports
+    videos/hour, p50/p95 per stage and function (from the metrics spans) and peak memory.
+
+    `latency` and `error_rate` map 'youtube', 'llm' and 'pexels' to that fake's setting. Runs in an empty `work_dir`
+    (a temporary one by default, deleted afterwards), so every cache starts cold."""
+    latency, error_rate = latency or {}, error_rate or {}
+    keep_work_dir = work_dir is not None
+    work_dir = os.path.abspath(work_dir) if work_dir else tempfile.mkdtemp(prefix="analyse_e2e_")
+    os.makedirs(work_dir, exist_ok=True)
+    stats_path = os.path.join(work_dir, 'fake_services.json')
+    fakes, servers = start_fake_services(latency, error_rate, stats_path)
+    cwd = os.getcwd()
+    os.chdir(work_dir) # Journal, caches, jobs and metrics are relative paths
+    try:
+        # Point the pipeline at the fakes. Only the fakes' latency and errors slow it down: no rate limits or daily quota.
+        analyse.TTS_ENGINE = 'offline'
+        analyse.PEXELS_BASE_URL = servers['pexels']['base_url']
+        analyse.BACKOFF_BASE_SECONDS = 0.1
+        if profile: analyse.ENCODING_PROFILE = profile # Recorded in each job (create_job), so spawned render workers use it too
+        analyse.SCHEDULER = analyse.RateScheduler({service: (1000, 1000) for service in analyse.RATE_LIMITS}, daily_quota=10 ** 9)
+        analyse.METRICS = analyse.MetricsRecorder()
+        analyse.llm = analyse.LLMClient(openai.OpenAI(base_url=servers['llm']['base_url'], api_key='fake', max_retries=0))
+        youtube = fake_services.fake_youtube_service(servers['youtube']['url'])
+        analyse._topic_providers[analyse.YOUTUBE_API_KEY] = analyse.TopicProvider(analyse.YOUTUBE_API_KEY, youtube=youtube)
+
+        analyse.peak_rss_bytes(reset=True)
+        start = time.perf_counter()
+        pipeline = analyse.ProductionPipeline(youtube, analyse.llm, analyse.get_processed_videos_hashes(), used_topics=set(), render_workers=render_workers)
+        try: completed = pipeline.run_batch(videos)
+        finally: pipeline.close()
+        elapsed = time.perf_counter() - start
+        spans = load_spans(analyse.METRICS_FOLDER)
+    finally:
+        os.chdir(cwd)
+        servers = stop_fake_services(fakes, stats_path)
+        if not keep_work_dir: shutil.rmtree(work_dir, ignore_errors=True)
+
+    worker_spans = [span['peak_rss_bytes'] for span in spans if span['pid'] != os.getpid()]
+    results = {'commit': git_commit(), 'videos': videos, 'uploaded': servers['youtube']['videos'], 'completed': completed, 'seconds': elapsed,
+               'videos_per_hour': completed / elapsed * 3600, 'profile': profile or analyse.ENCODING_PROFILE, 'render_workers': render_workers,
+               'latency': {name: servers[name]['latency'] for name in FAKE_SERVICES}, 'error_rate': {name: servers[name]['error_rate'] for name in FAKE_SERVICES},
+               'requests': {name: servers[name]['requests'] for name in FAKE_SERVICES},
+               'peak_rss_bytes': {'main': analyse.peak_rss_bytes(), 'render_worker': max(worker_spans, default=0)},
+               'spans': span_percentiles(spans)}
+
+    print(f"\nEnd to end, {videos} videos against local fakes (commit {results['commit'] or 'unknown'}, '{results['profile']}' profile, {render_workers} render workers):")
+    print(f"  {completed} completed ({results['uploaded']} uploaded) in {elapsed:.1f}s: {results['videos_per_hour']:.1f} videos/hour")
+    print(f"  Peak memory: main process {results['peak_rss_bytes']['main'] / 2 ** 20:.0f} MB | render worker {results['peak_rss_bytes']['render_worker'] / 2 ** 20:.0f} MB")
+    for name in FAKE_SERVICES: print(f"  {name:<8} requests: {results['requests'][name]}")
+    print(f"\n  {'span':<28} {'calls':>5} {'errors':>6} {'p50 s':>8} {'p95 s':>8} {'max s':>8}")
+    for name, stats in results['spans'].items():
+        print(f"  {name:<28} {stats['calls']:>5} {stats['errors']:>6} {stats['p50']:>8.2f} {stats['p95']:>8.2f} {stats['max']:>8.2f}")
+    if json_path:
+        with open(json_path, 'w') as f: json.dump(results, f, indent=2)
+        print(f"\nResults saved to {json_path}")
+    return results
+
+# ######################################################################
+# #################### COMMAND LINE ######################################
+# ######################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Performance benchmarks for analyse.py")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    thumbnails_parser = subparsers.add_parser('thumbnails', help="Pillow thumbnail engine vs the ImageMagick path")
+    thumbnails_parser.add_argument('--count', type=int, default=50)
+    profiles_parser = subparsers.add_parser('profiles', help="Encode time, file size and upload savings of each encoding profile")
+    profiles_parser.add_argument('--profile', action='append', choices=list(analyse.ENCODING_PROFILES), help="Profile to include (repeatable; default: all)")
+    profiles_parser.add_argument('--seconds', type=float, default=12)
+    profiles_parser.add_argument('--upload-mbps', type=float, default=20.0)
+    render_modes_parser = subparsers.add_parser('render-modes', help="Two-pass vs single-pass render time of the same video")
+    render_modes_parser.add_argument('--seconds', type=float, default=12)
+    e2e_parser = subparsers.add_parser('e2e', help="Videos/hour, per-stage p50/p95 and peak memory of the whole pipeline against local fake services")
+    e2e_parser.add_argument('--videos', type=int, default=3)
+    e2e_parser.add_argument('--render-workers', type=int, default=analyse.RENDER_WORKERS)
+    e2e_parser.add_argument('--profile', choices=list(analyse.ENCODING_PROFILES), help="Encoding profile (default: ENCODING_PROFILE)")
+    e2e_parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every fake response")
+    e2e_parser.add_argument('--error-rate', type=float, default=0.0, help="Share of fake requests failing with a 503")
+    for name in FAKE_SERVICES:
+        e2e_parser.add_argument(f'--{name}-latency', type=float, help=f"Overrides --latency for the {name} fake")
+        e2e_parser.add_argument(f'--{name}-error-rate', type=float, help=f"Overrides --error-rate for the {name} fake")
+    e2e_parser.add_argument('--work-dir', help="Run (and keep the journal, metrics and videos) here instead of a temporary directory")
+    e2e_parser.add_argument('--json', help="Also save the results as JSON, e.g. to compare commits")
+    args = parser.parse_args()
+
+    if args.benchmark == 'thumbnails': benchmark_thumbnails(args.count)
+    elif args.benchmark == 'profiles': benchmark_profiles(args.profile, args.seconds, args.upload_mbps)
+    elif args.benchmark == 'render-modes': benchmark_render_modes(args.seconds)
+    elif args.benchmark == 'e2e':
+        latency = {name: args.latency if getattr(args, f'{name}_latency') is None else getattr(args, f'{name}_latency') for name in FAKE_SERVICES}
+        error_rate = {name: args.error_rate if getattr(args, f'{name}_error_rate') is None else getattr(args, f'{name}_error_rate') for name in FAKE_SERVICES}
+        benchmark_e2e(args.videos, latency, error_rate, args.render_workers, args.profile, args.work_dir, args.json)
+    sys.exit(0)
@@ -0,0 +1,346 @@
+import io
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import signal
+import hashlib
+import argparse
+import tempfile
+import threading
+import collections
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import Image, ImageDraw
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+# ######################################################################
+# #################### LOCAL STAND-INS FOR EXTERNAL APIS #################
+# ######################################################################
+
+class FakeServer(ThreadingHTTPServer):
+    """Base for the local stand-ins: runs on a background thread, delays every response by `latency`
+    seconds and fails `error_rate` of the requests that change or fetch data with a 503."""
+
+    daemon_threads = True
+
+    def __init__(self, handler, port=0, latency=0.0, error_rate=0.0, seed=None):
+        super().__init__(('127.0.0.1', port), handler)
+        self.latency, self.error_rate = latency, error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = collections.Counter() # request kind -> count, plus 'failed'
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown(); self.server_close()
+
+    def should_fail(self):
+        with self.lock: return self.random.random() < self.error_rate
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args): pass
+
+    def _reply(self, status, body=None, headers=None, content_type='application/json'):
+        payload = body if isinstance(body, bytes) else json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        for name, value in (headers or {}).items(): self.send_header(name, value)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _error(self, status, message):
+        return self._reply(status, {'error': {'code': status, 'message': message}})
+
+    def _count(self, kind, can_fail=True):
+        """Waits out the latency and counts the request. Returns True (after replying 503) when it is picked to fail."""
+        time.sleep(self.server.latency)
+        with self.server.lock: self.server.requests[kind] += 1
+        if can_fail and self.server.should_fail():
+            with self.server.lock: self.server.requests['failed'] += 1
+            self._error(503, 'Backend Error')
+            return True
+        return False
+
+# --- YOUTUBE DATA API ---
+TOPIC_WORDS = (['Secret', 'Surprising', 'Viral', 'Unexpected', 'Hidden', 'Record-Breaking', 'Tiny', 'Giant'],
+               ['Octopus', 'Robot', 'Volcano', 'Recipe', 'Comet', 'Guitar Solo', 'Skateboard Trick', 'Garden'],
+               ['Explained', 'Goes Wrong', 'in 60 Seconds', 'Nobody Expected', 'Challenge', 'Review', 'Update', 'Reaction'])
+
+class FakeYouTubeServer(FakeServer):
+    """A local YouTube Data API: the mostPopular chart (videos.list), resumable uploads (videos.insert) and thumbnails.set.
+
+    `error_rate` of the chart pages, upload starts, chunk PUTs and thumbnail uploads fail with a 503
+    (after storing nothing), so retries and resumption can be exercised. Status queries never fail."""
+
+    def __init__(self, port=0, latency=0.0, error_rate=0.0, seed=None, chart_pages=4):
+        super().__init__(FakeYouTubeHandler, port, latency, error_rate, seed)
+        self.chart_pages = chart_pages
+        self.sessions = {} # session id -> {'metadata', 'size', 'data'}
+        self.videos = {} # video id -> {'metadata', 'data'}
+        self.thumbnails = {} # video id -> JPEG bytes
+
+    def chart_title(self, region, position):
+        """The chart entry at `position` for a region; titles are unique across regions and positions."""
+        first, second, third = TOPIC_WORDS
+        return f"{first[position % 8]} {second[position // 8 % 8]} {third[position // 64 % 8]} ({region} #{position + 1})"
+
+class FakeYouTubeHandler(FakeHandler):
+    def do_GET(self):
+        """Answers videos.list(chart='mostPopular') with 50 generated titles per page."""
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if not url.path.endswith('/youtube/v3/videos') or query.get('chart') != ['mostPopular']: return self._error(404, 'Not found')
+        if self._count('list'): return
+        region, page, per_page = query.get('regionCode', ['US'])[0], int(query.get('pageToken', ['0'])[0]), int(query.get('maxResults', ['5'])[0])
+        items = [{'kind': 'youtube#video', 'snippet': {'title': self.server.chart_title(region, page * per_page + i)}} for i in range(per_page)]
+        self._reply(200, {'kind': 'youtube#videoListResponse', 'items': items, **({'nextPageToken': str(page + 1)} if page + 1 < self.server.chart_pages else {})})
+
+    def do_POST(self):
+        """Starts a resumable upload (POST .../youtube/v3/videos?uploadType=resumable with the JSON metadata) or sets a thumbnail."""
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        body = self._read_body()
+        if url.path.endswith('/youtube/v3/thumbnails/set'):
+            if self._count('thumbnail'): return
+            video_id = query.get('videoId', [''])[0]
+            if video_id not in self.server.videos: return self._error(404, 'Video not found')
+            with self.server.lock: self.server.thumbnails[video_id] = body
+            return self._reply(200, {'kind': 'youtube#thumbnailSetResponse', 'items': [{'default': {'url': f"{self.server.url}thumbnails/{video_id}.jpg"}}]})
+        if not url.path.endswith('/youtube/v3/videos') or query.get('uploadType') != ['resumable']: return self._error(404, 'Not found')
+        if self._count('initiate'): return
+        session_id = uuid.uuid4().hex
+        with self.server.lock:
+            self.server.sessions[session_id] = {'metadata': json.loads(body or b'{}'), 'size': int(self.headers.get('X-Upload-Content-Length') or 0), 'data': bytearray()}
+        self._reply(200, headers={'Location': f"{self.server.url}upload/session/{session_id}"})
+
+    def do_PUT(self):
+        """Receives a chunk ('bytes a-b/total') or answers a status query ('bytes */total') for a session."""
+        data = self._read_body()
+        session_id = self.path.rsplit('/', 1)[-1]
+        with self.server.lock: session = self.server.sessions.get(session_id)
+        if session is None: return self._error(404, 'Upload session not found')
+        content_range = self.headers.get('Content-Range', '')
+        if content_range.startswith('bytes */'): self._count('status', can_fail=False)
+        else:
+            if self._count('chunk'): return
+            start = int(content_range.split(' ')[1].split('-')[0])
+            with self.server.lock:
+                if start != len(session['data']): return self._error(400, f"Expected offset {len(session['data'])}")
+                session['data'].extend(data)
+        if len(session['data']) >= session['size']:
+            video_id = session_id[:11]
+            with self.server.lock: self.server.videos[video_id] = {'metadata': session['metadata'], 'data': bytes(session['data'])}
+            return self._reply(200, {'kind': 'youtube#video', 'id': video_id, 'snippet': session['metadata'].get('snippet', {})})
+        headers = {'Range': f"bytes=0-{len(session['data']) - 1}"} if session['data'] else {}
+        self._reply(308, headers=headers)
+
+def fake_youtube_service(server):
+    """A googleapiclient YouTube service whose requests go to `server` (or the URL of one) instead of Google."""
+    document = json.loads(get_static_doc('youtube', 'v3'))
+    document['rootUrl'] = getattr(server, 'url', server)
+    return build_from_document(document, developerKey='fake')
+
+# --- OPENAI-COMPATIBLE CHAT (OPENROUTER) ---
+SCRIPT_TEMPLATES = ["Have you heard about {topic}", "Everyone is talking about it right now", "Here is what actually happened",
+                    "It started with something small and grew fast", "Experts say the details matter more than the headlines",
+                    "And the best part is still coming", "Some people saw it coming, most did not",
+                    "Like and subscribe if you want the next update on {topic}"]
+
+class FakeLLMServer(FakeServer):
+    """A local OpenAI-compatible chat completions endpoint (base URL: `server.base_url`).
+
+    Replies are generated from the prompt: the combined video package, metadata JSON, thumbnail text,
+    visual queries or a script of `sentences` sentences about the quoted topic."""
+
+    def __init__(self, port=0, latency=0.0, error_rate=0.0, seed=None, sentences=6):
+        super().__init__(FakeLLMHandler, port, latency, error_rate, seed)
+        self.sentences = sentences
+
+    @property
+    def base_url(self):
+        return f"{self.url}v1"
+
+    def script(self, topic):
+        return " ".join(SCRIPT_TEMPLATES[i % len(SCRIPT_TEMPLATES)].format(topic=topic) + "." for i in range(self.sentences))
+
+    def reply(self, prompt, json_mode):
+        match = re.search(r"topic: '(.*?)'", prompt) or re.search(r"video name: '(.*?)'", prompt)
+        topic = match.group(1) if match else "this trend"
+        metadata = {'title': f"{topic} - What You Need to Know", 'description': f"Everything about {topic} in under a minute.", 'tags': "trending,news,explained,shorts,viral,today,update,story,facts,video"}
+        if 'video package' in prompt:
+            script = self.script(topic)
+            return json.dumps({'script': script, 'visual_queries': [f"{topic.split(' (')[0]} scene {i + 1}" for i in range(script.count('.'))],
+                               'thumbnail_text': "YOU WON'T BELIEVE THIS", **metadata})
+        if json_mode: return json.dumps(metadata)
+        if 'thumbnail' in prompt.lower(): return "WAIT FOR IT"
+        if 'visual search queries' in prompt:
+            count = int(re.search(r"generate a list of (\d+)", prompt).group(1))
+            return "\n".join(f"{topic.split(' (')[0]} scene {i + 1}" for i in range(count))
+        return self.script(topic)
+
+class FakeLLMHandler(FakeHandler):
+    def do_POST(self):
+        """POST /v1/chat/completions with the usual OpenAI request body."""
+        body = json.loads(self._read_body() or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'): return self._error(404, 'Not found')
+        if self._count('chat'): return
+        prompt = next((m['content'] for m in reversed(body.get('messages', [])) if m.get('role') == 'user'), '')
+        content = self.server.reply(prompt, (body.get('response_format') or {}).get('type') == 'json_object')
+        self._reply(200, {'id': f"chatcmpl-{uuid.uuid4().hex[:12]}", 'object': 'chat.completion', 'created': int(time.time()), 'model': body.get('model', 'fake'),
+                          'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                          'usage': {'prompt_tokens': len(prompt.split()), 'completion_tokens': len(content.split()), 'total_tokens': len(prompt.split()) + len(content.split())}})
+
+# --- PEXELS ---
+def test_image(seed, size=(940, 627)):
+    """A synthetic photo (gradients and shapes, so it compresses like a photo rather than noise)."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size[1], 0:size[0]]
+    base = np.stack([(x * (seed % 5 + 1) / size[0]) * 255, (y / size[1]) * 255, np.full(x.shape, 60.0 * seed)], axis=-1) % 256
+    image = Image.fromarray((base + rng.normal(0, 2, base.shape)).clip(0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x0, y0 = int(rng.integers(0, size[0])), int(rng.integers(0, size[1]))
+        draw.ellipse([x0, y0, x0 + int(rng.integers(size[0] // 40, size[0] // 5)), y0 + int(rng.integers(size[1] // 20, size[1] // 3))],
+                     fill=tuple(int(c) for c in rng.integers(0, 256, 3)))
+    return image
+
+class FakePexelsServer(FakeServer):
+    """A local Pexels API (base URL: `server.base_url`): search returns one of `photo_count` generated photos
+    per query, and the photo URLs serve them as JPEGs of `image_size` (Pexels' 'large' is about 940x627)."""
+
+    def __init__(self, port=0, latency=0.0, error_rate=0.0, seed=None, photo_count=50, image_size=(940, 627)):
+        super().__init__(FakePexelsHandler, port, latency, error_rate, seed)
+        self.photo_count, self.image_size = photo_count, image_size
+        self.photos = {} # photo id -> JPEG bytes, generated on first request
+
+    @property
+    def base_url(self):
+        return f"{self.url}v1/"
+
+    def photo(self, photo_id):
+        with self.lock: data = self.photos.get(photo_id)
+        if data is None:
+            buffer = io.BytesIO()
+            test_image(photo_id, self.image_size).save(buffer, format='JPEG', quality=85)
+            with self.lock: data = self.photos.setdefault(photo_id, buffer.getvalue())
+        return data
+
+class FakePexelsHandler(FakeHandler):
+    def do_GET(self):
+        """GET /v1/search?query=... (one photo per page) and GET /photos/<id>.jpeg."""
+        url = urllib.parse.urlparse(self.path)
+        if url.path.endswith('/v1/search'):
+            if self._count('search'): return
+            query = urllib.parse.parse_qs(url.query).get('query', [''])[0]
+            photo_id = int(hashlib.sha256(query.encode()).hexdigest(), 16) % self.server.photo_count
+            width, height = self.server.image_size
+            return self._reply(200, {'page': 1, 'per_page': 1, 'total_results': 1, 'photos': [
+                {'id': photo_id, 'width': width, 'height': height, 'src': {'large': f"{self.server.url}photos/{photo_id}.jpeg"}}]})
+        match = re.fullmatch(r'/photos/(\d+)\.jpeg', url.path)
+        if not match or int(match.group(1)) >= self.server.photo_count: return self._error(404, 'Not found')
+        if self._count('image'): return
+        self._reply(200, self.server.photo(int(match.group(1))), content_type='image/jpeg')
+
+def server_stats(servers):
+    """URL, settings and request counts of each server (by name), plus how many videos the YouTube one received."""
+    return {name: {'url': server.url, 'base_url': getattr(server, 'base_url', server.url), 'latency': server.latency, 'error_rate': server.error_rate,
+                   'requests': dict(server.requests), **({'videos': len(server.videos)} if isinstance(server, FakeYouTubeServer) else {})}
+            for name, server in servers.items()}
+
+def write_stats(servers, path):
+    """Saves server_stats() as JSON, replacing `path` atomically so a reader never sees half a file."""
+    with open(f"{path}.tmp", 'w') as f: json.dump(server_stats(servers), f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def stop_on_sigterm(sig, frame):
+    """Lets `serve` shut down (and write its stats) on SIGTERM the way it does on Ctrl+C."""
+    raise KeyboardInterrupt
+
+# ######################################################################
+# #################### SELF-CHECK ########################################
+# ######################################################################
+
+def check_resumable_upload(size_mb=20, chunk_mb=1, error_rate=0.2, latency=0.0):
+    """Uploads a random file through analyse.upload_video_to_youtube, stopping the process halfway (simulated)
+    and resuming from the checkpoint, with `error_rate` of the chunks failing. Returns True if the bytes arrived intact."""
+    import analyse
+    analyse.UPLOAD_CHUNK_SIZE = chunk_mb * 1024 * 1024
+    analyse.BACKOFF_BASE_SECONDS = 0.05
+    analyse.SCHEDULER.quota_file = os.path.join(tempfile.gettempdir(), f"fake_quota_{os.getpid()}.json")
+    server = FakeYouTubeServer(latency=latency, error_rate=error_rate).start()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, 'fake_video.mov')
+        with open(video_path, 'wb') as f: f.write(os.urandom(size_mb * 1024 * 1024))
+        youtube = fake_youtube_service(server)
+
+        save_checkpoint, saved = analyse.save_upload_checkpoint, []
+        def interrupt_halfway(path, uri, offset):
+            save_checkpoint(path, uri, offset); saved.append(offset)
+            if len(saved) == max(1, size_mb // chunk_mb // 2): raise KeyboardInterrupt("simulated restart")
+        analyse.save_upload_checkpoint = interrupt_halfway
+        try: analyse.upload_video_to_youtube(youtube, video_path, 'Fake', 'Fake upload', 'a,b')
+        except KeyboardInterrupt: print(f"  -> Interrupted after {saved[-1] / 1e6:.1f} MB; resuming from the checkpoint...")
+        finally: analyse.save_upload_checkpoint = save_checkpoint
+
+        stats = {}
+        video_id = analyse.upload_video_to_youtube(fake_youtube_service(server), video_path, 'Fake', 'Fake upload', 'a,b', stats=stats)
+        with open(video_path, 'rb') as f: intact = video_id in server.videos and server.videos[video_id]['data'] == f.read()
+    server.stop()
+    print(f"Requests: {dict(server.requests)} | upload stats: {stats} | sessions started: {len(server.sessions)} | intact: {intact}")
+    return intact
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-ins for the external APIs used by analyse.py")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help="Run the fake YouTube, chat (OpenRouter) and Pexels servers on three consecutive ports")
+    serve_parser.add_argument('--port', type=int, default=8089, help="Port of the YouTube server; chat and Pexels use the next two (0: any free ports)")
+    serve_parser.add_argument('--stats-file', help="Write the URLs and settings as JSON here once listening, and again with the request counts on exit")
+    check_parser = subparsers.add_parser('check-upload', help="Resumable upload round trip with a simulated restart and failing chunks")
+    for p in (serve_parser, check_parser):
+        p.add_argument('--latency', type=float, default=0.0)
+        p.add_argument('--error-rate', type=float, default=0.2)
+    for name in ('youtube', 'llm', 'pexels'):
+        serve_parser.add_argument(f'--{name}-latency', type=float, help=f"Overrides --latency for the {name} server")
+        serve_parser.add_argument(f'--{name}-error-rate', type=float, help=f"Overrides --error-rate for the {name} server")
+    check_parser.add_argument('--size-mb', type=int, default=20)
+    check_parser.add_argument('--chunk-mb', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        settings = {name: (args.latency if getattr(args, f'{name}_latency') is None else getattr(args, f'{name}_latency'),
+                           args.error_rate if getattr(args, f'{name}_error_rate') is None else getattr(args, f'{name}_error_rate'))
+                    for name in ('youtube', 'llm', 'pexels')}
+        port = lambda offset: args.port and args.port + offset
+        servers = {'youtube': FakeYouTubeServer(port(0), *settings['youtube'], seed=1), 'llm': FakeLLMServer(port(1), *settings['llm'], seed=2),
+                   'pexels': FakePexelsServer(port(2), *settings['pexels'], seed=3)}
+        print(f"Fake YouTube API on {servers['youtube'].url}, chat completions on {servers['llm'].base_url}, Pexels on {servers['pexels'].base_url} (Ctrl+C to stop)", flush=True)
+        signal.signal(signal.SIGTERM, stop_on_sigterm)
+        servers['youtube'].start(); servers['llm'].start()
+        if args.stats_file: write_stats(servers, args.stats_file)
+        try: servers['pexels'].serve_forever()
+        except KeyboardInterrupt:
+            for server in servers.values(): server.server_close()
+            if args.stats_file: write_stats(servers, args.stats_file)
+    else: sys.exit(0 if check_resumable_upload(args.size_mb, args.chunk_mb, args.error_rate, args.latency) else 1)